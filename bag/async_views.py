@@ -0,0 +1,26 @@
+from . import views
+from boutique_ado.threads import in_own_thread
+
+"""
+Async versions of the bag views, used when ASYNC_VIEWS is set (settings.py).
+
+The bag is kept in the session, and reading the session can go to the database or the cache,
+which Django 3.2 can only do synchronously. So the sync views in views.py do the work, in a thread
+of the pool (boutique_ado/threads.py), and other requests are served while they wait.
+"""
+
+
+async def view_bag(request):
+    return await in_own_thread(views.view_bag)(request)
+
+
+async def add_to_bag(request, item_id):
+    return await in_own_thread(views.add_to_bag)(request, item_id)
+
+
+async def adjust_bag(request, item_id):
+    return await in_own_thread(views.adjust_bag)(request, item_id)
+
+
+async def remove_from_bag(request, item_id):
+    return await in_own_thread(views.remove_from_bag)(request, item_id)
@@ -1,23 +1,69 @@
-from decimal import Decimal  # more accurate than float better with money
+import copy
 from django.conf import settings
-from django.shortcuts import get_object_or_404
+from django.contrib import messages
 from products.models import Product
+from checkout.models import totals_for
 
 # quantity changed to item_ data because Since there are now two different types of data that might be in our bag items.
 # In the case of an item with no sizes. The item data will just be the quantity.
 # But in the case of an item that has sizes the sitem data will be a dictionary of all the items by size.
 
 def bag_contents(request):
+    """
+    This runs as a context processor on every rendered page, so the result is
+    remembered on the request. Calling it again from a view (checkout does this)
+    or rendering a second template doesn't cost another query,
+    unless the bag in the session has changed in between.
+    """
+    bag = request.session.get('bag', {})
+
+    cached = getattr(request, '_bag_contents', None)
+    if cached is not None and cached[0] == bag:
+        return cached[1]
+
+    context, missing = _build_bag_contents(bag)
+    if missing:
+        # the products were deleted after they were added to the bag. They're taken out of the
+        # session bag too, otherwise checkout would charge for a bag we can't make an order of
+        # and the customer couldn't remove them (they're not shown and remove_from_bag 404s).
+        request.session['bag'] = bag
+        if len(missing) == 1:
+            message = "A product in your bag isn't available anymore and was removed from your bag."
+        else:
+            message = f"{len(missing)} products in your bag aren't available anymore and were removed from your bag."
+        messages.warning(request, message, fail_silently=True)
+    # store a copy of the bag, the views mutate the session bag in place
+    request._bag_contents = (copy.deepcopy(bag), context)
+    return context
+
+
+def drop_missing_products(bag, products):
+    """
+    Take the items out of bag whose product isn't in products (the in_bulk of the bag),
+    returns their ids. Shared with checkout/order_builder.py so the bag we charge for
+    and the order we make of it leave out the same products.
+    """
+    missing = [item_id for item_id in bag if int(item_id) not in products]
+    for item_id in missing:
+        del bag[item_id]
+    return missing
 
+
+def _build_bag_contents(bag):
+    """The context for bag, and the ids of the items that were dropped from it"""
     bag_items = []
     total = 0
     product_count = 0
 
-    bag = request.session.get('bag', {})
+    # get all the products in the bag in one query instead of one query per item.
+    # An empty bag (most visitors) doesn't query the database at all.
+    products = Product.objects.in_bulk(bag.keys()) if bag else {}
+    missing = drop_missing_products(bag, products)
 
     for item_id, item_data in bag.items():  # The items() method returns a view object that displays a list of dictionary's (key, value) tuple pairs.
+        product = products[int(item_id)]
+
         if isinstance(item_data, int):
-            product = get_object_or_404(Product, pk=item_id)
             total += item_data * product.price
             product_count += item_data
             bag_items.append({
@@ -26,7 +72,6 @@ def bag_contents(request):
                 'product': product,
             })
         else:
-            product = get_object_or_404(Product, pk=item_id)
             for size, quantity in item_data['items_by_size'].items():
                 total += quantity * product.price
                 product_count += quantity
@@ -36,18 +81,14 @@ def bag_contents(request):
                     'product': product,
                     'size': size,
                 })
-    
-
-
 
     if total < settings.FREE_DELIVERY_THRESHOLD:
-        delivery = total * Decimal(settings.STANDARD_DELIVERY_PERCENTAGE/100)
         free_delivery_delta = settings.FREE_DELIVERY_THRESHOLD - total
     else:
-        delivery = 0
         free_delivery_delta = 0
-    
-    grand_total = delivery + total
+
+    # rounded to cents like the order will be, checkout charges the grand total
+    delivery, grand_total = totals_for(total)
 
     context = {
         'bag_items': bag_items,
@@ -60,4 +101,4 @@ def bag_contents(request):
 
     }
 
-    return context
\ No newline at end of file
+    return context, missing
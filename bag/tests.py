@@ -1,3 +1,27 @@
+from django.contrib.messages import get_messages
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from products.models import Product
+
+
+class BagContentsTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(sku='bag-test-1', name='Linen Shirt', description='', price='10.00')
+        deleted = Product.objects.create(sku='bag-test-2', name='Old Scarf', description='', price='5.00')
+        self.deleted_id = str(deleted.id)
+        deleted.delete()
+
+    def test_deleted_product_is_removed_from_the_session_bag(self):
+        session = self.client.session
+        session['bag'] = {str(self.product.id): 2, self.deleted_id: 1}
+        session.save()
+
+        response = self.client.get(reverse('view_bag'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['bag'], {str(self.product.id): 2})
+        self.assertEqual(response.context['grand_total'], response.context['total'] + response.context['delivery'])
+        self.assertEqual(response.context['total'], 20)
+        self.assertIn("isn't available anymore", ' '.join(str(m) for m in get_messages(response.wsgi_request)))
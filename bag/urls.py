@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+bag_views = async_views if settings.ASYNC_VIEWS else views  # see async_views.py
 
 urlpatterns = [
-    path('', views.view_bag, name='view_bag'),
-    path('add/<item_id>/', views.add_to_bag, name='add_to_bag'),
-    path('adjust/<item_id>/', views.adjust_bag, name='adjust_bag'),
-    path('remove/<item_id>/', views.remove_from_bag, name='remove_from_bag'),
+    path('', bag_views.view_bag, name='view_bag'),
+    path('add/<item_id>/', bag_views.add_to_bag, name='add_to_bag'),
+    path('adjust/<item_id>/', bag_views.adjust_bag, name='adjust_bag'),
+    path('remove/<item_id>/', bag_views.remove_from_bag, name='remove_from_bag'),
 ]
@@ -1,10 +1,19 @@
-from django.shortcuts import render, redirect, reverse, HttpResponse, get_object_or_404
+from django.shortcuts import render, redirect, reverse, HttpResponse
+from django.http import Http404
 from django.contrib import messages
-from products.models import Product
+from products.cache import get_product
 
 
 # Create your views here.
 
+def _get_product_or_404(item_id):
+    """The product from the catalogue cache, so changing the bag doesn't need the database"""
+    product = get_product(item_id)
+    if product is None:
+        raise Http404('No product found')
+    return product
+
+
 def view_bag(request):
     """ A view that renders the bag contents page """
 
@@ -13,7 +22,7 @@ def view_bag(request):
 def add_to_bag(request, item_id):  # it takes in the request and the id of the product the user wants to add
     """add a quantity of the product to the bag """
     # get the product
-    product = get_object_or_404(Product, pk=item_id)
+    product = _get_product_or_404(item_id)
 
     quantity = int(request.POST.get('quantity'))  # get qty from form, convert to integer as it is a string from the form
     redirect_url = request.POST.get('redirect_url')  # get the redirect URL from the form so we know where to redirect once the process here is finished.
@@ -67,7 +76,7 @@ def add_to_bag(request, item_id):  # it takes in the request and the id of the p
 
 def adjust_bag(request, item_id):  # it takes in the request and the id of the product the user wants to add
     """adjust the quantity of the specified product to the specified amount """
-    product = get_object_or_404(Product, pk=item_id)
+    product = _get_product_or_404(item_id)
 
 
     quantity = int(request.POST.get('quantity'))  # get qty from form, convert to integer as it is a string from the form
@@ -122,7 +131,7 @@ def adjust_bag(request, item_id):  # it takes in the request and the id of the p
 
 def remove_from_bag(request, item_id):  # it takes in the request and the id of the product the user wants to add
     """remove item from bag"""
-    product = get_object_or_404(Product, pk=item_id)
+    product = _get_product_or_404(item_id)
 
     print(item_id)
     try:
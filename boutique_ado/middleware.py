@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+"""
+What every request costs, when REQUEST_TIMING is set (settings.py).
+
+RequestTimingMiddleware counts the SQL queries and their time, the time spent rendering
+templates and the time spent waiting for Stripe (checkout/stripe_client.py), and adds them
+to the response as a Server-Timing header (the browser dev tools show it in the network tab):
+Server-Timing: db;dur=12.5;desc="9 queries", tpl;dur=30.1, stripe;dur=0.0, total;dur=51.2
+and writes them as one JSON log line per request (logger boutique_ado.timing).
+
+It also looks for N+1 queries: the same SELECT (with different parameters) run again and
+again in one request, like a query per bag item in bag_contents or per line item in a template.
+Those are logged with the line of our code that ran the query.
+
+The template time includes the queries run while rendering (lazy querysets, context processors).
+Queries run in another thread (the async views, boutique_ado/threads.py) are counted through
+timing_this_thread, the connections are per thread.
+Without REQUEST_TIMING the middleware removes itself when Django starts, so it costs nothing.
+It's sync only, under uvicorn (ASYNC_VIEWS) it makes Django serve the requests one at a time,
+so the numbers are right but not the throughput.
+"""
+
+logger = logging.getLogger('boutique_ado.timing')
+
+_current = ContextVar('request_timing', default=None)
+_template_render = Template.render
+
+
+class RequestTiming:
+    """The numbers of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.rendering = False
+        self.stripe = 0.0
+        self.stripe_calls = 0
+        self.selects = Counter()  # SELECT statement: times it ran
+        self.repeated = {}  # SELECT statement: where in our code it was first repeated too often
+        self.query_wrapper = None  # counts a query, for the connections of other threads
+
+
+def record_stripe_call(seconds):
+    """Called by checkout/stripe_client.py after every Stripe call"""
+    timing = _current.get()
+    if timing is not None:
+        timing.stripe += seconds
+        timing.stripe_calls += 1
+
+
+@contextmanager
+def timing_this_thread():
+    """Count the queries the current request runs on this thread's database connections too"""
+    timing = _current.get()
+    with ExitStack() as stack:
+        if timing is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timing.query_wrapper))
+        yield
+
+
+def _timed_render(self, *args, **kwargs):
+    """Template.render of the Django template backend, replaced by this while the middleware is on"""
+    timing = _current.get()
+    if timing is None or timing.rendering:
+        return _template_render(self, *args, **kwargs)  # templates rendered inside a template (crispy forms) are counted already
+    timing.rendering = True
+    started = time.perf_counter()
+    try:
+        return _template_render(self, *args, **kwargs)
+    finally:
+        timing.template += time.perf_counter() - started
+        timing.rendering = False
+
+
+def _our_code():
+    """The innermost line of the project's own code in the current stack, like bag/contexts.py:25"""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        filename = frame.filename
+        if filename.startswith(str(settings.BASE_DIR)) and 'site-packages' not in filename \
+                and not filename.endswith('middleware.py'):
+            return f'{filename[len(str(settings.BASE_DIR)) + 1:]}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class RequestTimingMiddleware:
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = settings.REQUEST_TIMING_REPEATED_QUERIES
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        timing.query_wrapper = self._query_wrapper(timing)
+        token = _current.set(timing)
+        try:
+            with timing_this_thread():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = (time.perf_counter() - timing.started) * 1000
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timing.db * 1000:.1f};desc="{timing.queries} queries"',
+            f'tpl;dur={timing.template * 1000:.1f}',
+            f'stripe;dur={timing.stripe * 1000:.1f}',
+            f'total;dur={total:.1f}',
+        ])
+        self._log(request, response, timing, total)
+        return response
+
+    def _query_wrapper(self, timing):
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timing.db += time.perf_counter() - started
+                timing.queries += 1
+                if sql.lstrip()[:6].upper() == 'SELECT':
+                    timing.selects[sql] += 1
+                    if timing.selects[sql] == self.threshold:
+                        timing.repeated[sql] = _our_code()  # only looked up once per statement
+        return wrapper
+
+    def _log(self, request, response, timing, total):
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'total_ms': round(total, 1),
+            'queries': timing.queries,
+            'db_ms': round(timing.db * 1000, 1),
+            'template_ms': round(timing.template * 1000, 1),
+            'stripe_ms': round(timing.stripe * 1000, 1),
+            'stripe_calls': timing.stripe_calls,
+        }
+        if timing.repeated:
+            line['n_plus_one'] = [
+                {'sql': sql if len(sql) <= 300 else f'{sql[:100]} ... {sql[-200:]}',  # the WHERE is at the end
+                 'count': timing.selects[sql], 'from': where}
+                for sql, where in timing.repeated.items()
+            ]
+            logger.warning(json.dumps(line))
+        else:
+            logger.info(json.dumps(line))
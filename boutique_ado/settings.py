@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 if os.path.isfile('env.py'):
     import env
@@ -62,6 +63,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'boutique_ado.middleware.RequestTimingMiddleware',  # first, so it sees the queries of the other middleware too
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -102,7 +104,29 @@ TEMPLATES = [
     },
 ]
 
-MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+# Sessions
+# The shopping bag lives in the session, so every add/adjust/remove writes the session.
+# SESSION_STORE picks where sessions are kept:
+# db (the default), cached_db (read from the cache, still written to the database),
+# cache (only the cache from CACHE_URL, use redis so sessions survive restarts)
+# (both cache ones need a cache the gunicorn workers share, see CACHE_SHARED below)
+# or signed_cookies (in the browser, the database is never touched).
+# The bag is stored as compact JSON (no spaces) and signed cookies are also zlib compressed.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_STORE = os.environ.get('SESSION_STORE', 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_STORE]
+SESSION_SERIALIZER = 'django.contrib.sessions.serializers.JSONSerializer'
+
+if SESSION_STORE == 'db':
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
+else:
+    # messages go in their own cookie first, so a flash message doesn't cost another session write
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.fallback.FallbackStorage'
 
 AUTHENTICATION_BACKENDS = [
     # Needed to login by username in Django admin, regardless of `allauth`
@@ -141,6 +165,53 @@ else:
     }
 
 
+# Cache
+# CACHE_URL picks the cache backend shared by all the gunicorn workers:
+# locmem:// (the default, one cache per process), file:///path/to/dir or redis://host:port/db
+# The VERSION is part of every key, changing CACHE_VERSION empties the cache without touching the server.
+# A locmem cache isn't shared: every gunicorn worker and every manage.py command has its own,
+# so a change made in one process (like bumping the catalogue version) never reaches the others.
+# CACHE_SHARED says if the cache can hold data that has to be the same for every process,
+# without it the catalogue (products/cache.py) is always read from the database.
+
+CACHE_URL = os.environ.get('CACHE_URL', 'locmem://')
+CACHE_SHARED = not CACHE_URL.startswith('locmem://')
+
+if CACHE_URL.startswith('redis'):
+    CACHE_BACKEND = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': CACHE_URL,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'IGNORE_EXCEPTIONS': True,  # the shop keeps working (uncached) if redis is down
+        },
+    }
+elif CACHE_URL.startswith('file://'):
+    CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_URL[len('file://'):],
+    }
+else:
+    CACHE_BACKEND = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'boutique-ado',
+    }
+
+CACHES = {
+    'default': {
+        **CACHE_BACKEND,
+        'KEY_PREFIX': 'boutique_ado',
+        'VERSION': int(os.environ.get('CACHE_VERSION', 1)),
+        'TIMEOUT': 60 * 5,
+    }
+}
+
+if SESSION_STORE in ('cache', 'cached_db') and not CACHE_SHARED:
+    # with a cache per worker a visitor's next request, on another worker, has another (or an old) session:
+    # the bag and the login would come and go
+    raise ImproperlyConfigured(f'SESSION_STORE={SESSION_STORE} needs a shared cache, set CACHE_URL to redis:// or file://')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -182,15 +253,36 @@ STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)  # tells django where the
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')  # where all uploaded media files will go
+PRODUCT_IMAGE_WIDTHS = (300, 600, 1200)  # widths of the smaller copies of product images, see products/images.py
 
 FREE_DELIVERY_THRESHOLD = 50
 STANDARD_DELIVERY_PERCENTAGE = 10
+# incremental: a line item change adds the difference to the order totals in one UPDATE (checkout/order_totals.py)
+# recalculate: Order.update_total sums all the line items and saves the order
+ORDER_TOTALS_MODE = os.environ.get('ORDER_TOTALS_MODE', 'incremental')
+PRODUCTS_PER_PAGE = 24  # divisible by 2, 3 and 4 so every row of product cards is full
+# a placed order doesn't change, see checkout/confirmation_cache.py. Only cached in a shared cache:
+# an order changed in the admin or by verify_order_totals --fix is forgotten in that process's cache only,
+# with a cache per process the other workers would show the old confirmation for a month.
+ORDER_CONFIRMATION_CACHE_TIMEOUT = 60 * 60 * 24 * 30 if CACHE_SHARED else 0
+# The product cards (products/products.html) are cached per product and updated_at, so an edited product
+# gets a new card in every process. A renamed or deleted category doesn't change updated_at, its cards are
+# deleted (products/signals.py), but only from this process's cache when it isn't shared, so keep them short then.
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60 * 24 if CACHE_SHARED else 60
+ORDER_HISTORY_PER_PAGE = 10  # orders on the profile page, older ones are loaded when scrolling down
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# STATIC_MANIFEST: collectstatic gives the static files hashed names, see custom_storages.py.
+# Locally they go to STATIC_ROOT with .gz/.br copies, with USE_AWS to S3.
+STATIC_MANIFEST = 'STATIC_MANIFEST' in os.environ
+if STATIC_MANIFEST:
+    STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+    STATICFILES_STORAGE = 'custom_storages.CompressedManifestStaticStorage'
+
 if 'USE_AWS' in os.environ:
     # cache control
     AWS_S3_OBJECT_PARAMETERS = {
@@ -198,21 +290,37 @@ if 'USE_AWS' in os.environ:
         'CacheControl': 'max-age=94608000',
     }
     # bucket config
-    AWS_STORAGE_BUCKET_NAME = 'butik-ado'
+    AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME', 'butik-ado')
     AWS_S3_REGION_NAME = 'eu-north-1'
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
-    AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
+    # another S3 server, like moto or minio when testing
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
+    AWS_S3_CUSTOM_DOMAIN = None if AWS_S3_ENDPOINT_URL else f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
     # static and media files
-    STATICFILES_STORAGE = 'custom_storages.StaticStorage'
+    STATICFILES_STORAGE = 'custom_storages.ManifestS3StaticStorage' if STATIC_MANIFEST \
+        else 'custom_storages.StaticStorage'
     STATICFILES_LOCATION = 'static'
     DEFAULT_FILE_STORAGE = 'custom_storages.MediaStorage'
     MEDIAFILES_LOCATION = 'media'
 
     # override static and media urls in production
-    STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{STATICFILES_LOCATION}/'
-    MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{MEDIAFILES_LOCATION}/'
+    if AWS_S3_CUSTOM_DOMAIN:
+        STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{STATICFILES_LOCATION}/'
+        MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{MEDIAFILES_LOCATION}/'
+    else:
+        STATIC_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/{STATICFILES_LOCATION}/'
+        MEDIA_URL = f'{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/{MEDIAFILES_LOCATION}/'
+elif STATIC_MANIFEST:
+    # gunicorn serves STATIC_ROOT itself with WhiteNoise (boutique_ado/static_files.py),
+    # with the .gz/.br copy the browser accepts.
+    # The hashed names (the same test as on S3, see custom_storages.py) get Cache-Control: immutable,
+    # the files with their own names a short max-age.
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                      'boutique_ado.static_files.StaticFilesMiddleware')
+    WHITENOISE_IMMUTABLE_FILE_TEST = r'\.[0-9a-f]{12}\.'
+    WHITENOISE_MAX_AGE = 300
 
 # Stripe
 STRIPE_CURRENCY = 'usd'
@@ -221,6 +329,39 @@ STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 
 STRIPE_WH_SECRET = os.getenv('STRIPE_WH_SECRET', '')
 
+# used by checkout/stripe_client.py
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', '')  # another server than api.stripe.com, like stripe-mock
+STRIPE_POOL_SIZE = 10  # connections to Stripe kept open per process
+STRIPE_MAX_NETWORK_RETRIES = 2
+STRIPE_TIMEOUTS = {  # seconds per operation
+    'default': 10,
+    'payment_intent.create': 10,
+    'payment_intent.modify': 5,  # the customer is waiting on this one before paying
+    'payment_intent.retrieve': 5,
+    'charge.retrieve': 10,
+}
+STRIPE_METRICS_LOG_INTERVAL = 60  # seconds, see checkout/stripe_client.py
+
+# ASYNC_VIEWS: serve the site with uvicorn workers (gunicorn.conf.py) and use the async versions
+# of the catalogue, bag, checkout and cache_checkout_data views (async_views.py in those apps).
+ASYNC_VIEWS = 'ASYNC_VIEWS' in os.environ
+
+# REQUEST_TIMING: add a Server-Timing header and a log line with the queries, template and
+# Stripe time of every request, and warn about N+1 queries (boutique_ado/middleware.py)
+REQUEST_TIMING = 'REQUEST_TIMING' in os.environ
+REQUEST_TIMING_REPEATED_QUERIES = 5  # the same SELECT this many times in one request is logged as N+1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'boutique_ado.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'boutique_ado.stripe': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
 
 # Email
 if 'DEVELOPMENT' in os.environ:
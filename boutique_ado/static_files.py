@@ -0,0 +1,32 @@
+import asyncio
+
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+"""
+WhiteNoise for STATIC_ROOT (STATIC_MANIFEST in settings.py), under the sync and the async workers.
+
+WhiteNoiseMiddleware is sync only. Under uvicorn (ASYNC_VIEWS) Django would run it, and so every
+request through it, on its one thread for sync code, and the async views would be served one at a time.
+Finding a static file is a dict lookup, so here it's done in the event loop and anything else is
+passed on to the async views.
+"""
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # Django awaits it, like MiddlewareMixin
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+        return super().__call__(request)
+
+    async def _acall(self, request):
+        static_file = self.find_file(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,74 @@
+import json
+import re
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.template.backends.django import Template
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import path, reverse
+
+from . import middleware
+from .middleware import RequestTimingMiddleware
+from products.models import Product
+
+
+def repeated_queries(request):
+    """One SELECT per product, the N+1 the middleware looks for"""
+    names = []
+    for pk in range(1, 4):
+        names.append(Product.objects.filter(pk=pk).values_list('name', flat=True).first())
+    return HttpResponse(', '.join(filter(None, names)))
+
+
+urlpatterns = [
+    path('repeated/', repeated_queries),
+]
+
+
+@override_settings(REQUEST_TIMING=True)
+class RequestTimingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        # the middleware replaces Template.render for the process, put it back after every test
+        self.addCleanup(setattr, Template, 'render', middleware._template_render)
+        self.client = Client()  # the middleware is loaded with the settings of the test
+
+    def test_server_timing_header(self):
+        Product.objects.create(sku='timing-test-1', name='Silk Scarf', description='', price='15.00')
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('boutique_ado.timing'):
+            response = self.client.get(reverse('products'))
+
+        timings = dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+        self.assertEqual(set(timings), {'db', 'tpl', 'stripe', 'total'})
+        self.assertGreater(len(queries), 0)
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertGreater(float(timings['db']), 0)
+        self.assertGreater(float(timings['tpl']), 0)
+        self.assertEqual(float(timings['stripe']), 0)
+        self.assertGreaterEqual(float(timings['total']), float(timings['db']))
+
+    @override_settings(ROOT_URLCONF='boutique_ado.tests', REQUEST_TIMING_REPEATED_QUERIES=3)
+    def test_repeated_queries_are_logged_with_where_they_come_from(self):
+        with self.assertLogs('boutique_ado.timing', 'WARNING') as logs:
+            self.client.get('/repeated/')
+
+        line = json.loads(logs.records[0].getMessage())
+        [repeated] = line['n_plus_one']
+        self.assertEqual(repeated['count'], 3)
+        self.assertRegex(repeated['from'], r'^boutique_ado/tests\.py:\d+ in repeated_queries$')
+
+    @override_settings(ROOT_URLCONF='boutique_ado.tests', REQUEST_TIMING_REPEATED_QUERIES=4)
+    def test_fewer_repeats_are_not_logged(self):
+        with self.assertLogs('boutique_ado.timing', 'INFO') as logs:
+            self.client.get('/repeated/')
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertNotIn('n_plus_one', json.loads(logs.records[0].getMessage()))
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_not_used_without_request_timing(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestTimingMiddleware(lambda request: HttpResponse())
+        self.assertIs(Template.render, middleware._template_render)
+        self.assertNotIn('Server-Timing', self.client.get('/'))
@@ -0,0 +1,29 @@
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .middleware import timing_this_thread
+
+"""
+Database work for the async views (ASYNC_VIEWS in settings.py), in threads that run side by side.
+
+sync_to_async runs everything on one thread by default (thread_sensitive), so while one request
+waits for the database or renders its template every other request of the worker waits for it.
+in_own_thread runs it in the event loop's thread pool instead, like
+await in_own_thread(views.all_products)(request)
+
+Every thread has its own database connections (that's how Django keeps them), request_finished
+only closes the ones of the main thread, so these are closed here the same way after every call.
+Stripe calls go to their own pool, see checkout/stripe_client.py in_thread_pool.
+"""
+
+
+def in_own_thread(func):
+    """func as a coroutine function, run in a thread of the pool"""
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            with timing_this_thread():
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderLineItem
+from .models import Order, OrderLineItem, WebhookJob, OutboxEmail
 
 # Register your models here.
 
@@ -23,4 +23,21 @@ class OrderAdmin(admin.ModelAdmin):
                     'order_total', 'delivery_cost', 'grand_total',)
     ordering = ('-date',)
 
-admin.site.register(Order, OrderAdmin)
\ No newline at end of file
+
+class WebhookJobAdmin(admin.ModelAdmin):
+    """So we can see what the webhook worker is doing, and what failed"""
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'created', 'processed')
+    list_filter = ('status', 'event_type')
+    readonly_fields = ('event_id', 'event_type', 'payload', 'attempts', 'created', 'processed', 'result')
+    ordering = ('-created',)
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """The emails waiting to be sent, and the ones the mail server refused"""
+    list_display = ('order', 'kind', 'status', 'attempts', 'created', 'sent')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('order', 'kind', 'attempts', 'created', 'sent', 'error')
+    ordering = ('-created',)
+
+admin.site.register(Order, OrderAdmin)
+admin.site.register(WebhookJob, WebhookJobAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import json
+
+from django.contrib import messages
+from django.http import HttpResponse, HttpResponseNotAllowed
+
+from . import views
+from .stripe_client import in_thread_pool, modify_payment_intent
+from bag.contexts import bag_contents
+from boutique_ado.threads import in_own_thread
+
+"""
+Async versions of checkout and cache_checkout_data, used when ASYNC_VIEWS is set (settings.py).
+
+These are the checkout calls the customer waits on, and most of their time is spent waiting
+for Stripe. Here that wait happens in the Stripe thread pool (stripe_client.in_thread_pool)
+and the database work in threads of its own (boutique_ado/threads.py), so a slow Stripe
+doesn't keep a worker from serving other requests.
+"""
+
+
+def _bag_and_username(request):
+    """Both can need the database (the session and the user), so this runs in a thread"""
+    return json.dumps(request.session.get('bag', {})), str(request.user)
+
+
+def _bag_total_and_intent(request):
+    """The bag, its total in cents (like in views.checkout) and the payment intent kept in the session"""
+    bag = request.session.get('bag', {})
+    if not bag:
+        return bag, None, None
+    return bag, round(bag_contents(request)['grand_total'] * 100), request.session.get('payment_intent')
+
+
+def _save_intent_and_render(request, saved, intent):
+    views.save_payment_intent(request, saved, intent)
+    return views.checkout_page(request, intent['client_secret'])
+
+
+async def checkout(request):
+    if request.method == 'POST':
+        # placing the order only needs the database, Stripe isn't called
+        return await in_own_thread(views.checkout)(request)
+
+    bag, stripe_total, saved = await in_own_thread(_bag_total_and_intent)(request)
+    if not bag:
+        return await in_own_thread(views.checkout)(request)  # the message and the redirect to the products
+    intent = await in_thread_pool(views.payment_intent_for_total, saved, stripe_total)
+    return await in_own_thread(_save_intent_and_render)(request, saved, intent)
+
+
+async def cache_checkout_data(request):
+    # require_POST in Django 3.2 only wraps sync views
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        pid = request.POST.get('client_secret').split('_secret')[0]
+        bag, username = await in_own_thread(_bag_and_username)(request)
+        await in_thread_pool(modify_payment_intent, pid, metadata={
+            'bag': bag,
+            'save_info': request.POST.get('save_info'),
+            'username': username,
+        })
+        return HttpResponse(status=200)
+
+    except Exception as e:
+        messages.error(request, 'Your payment could not be processed, try again later.')
+        return HttpResponse(content=e, status=400)
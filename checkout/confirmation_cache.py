@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+from .models import Order
+
+"""
+The order details on checkout_success.html are cached per order number (the {% cache %} tag
+in the template), for checkout_success and the order history on the profile page.
+A placed order doesn't change, so the fragment is kept for a long time
+(ORDER_CONFIRMATION_CACHE_TIMEOUT in settings.py). When an order is changed anyway,
+like in the admin, the signals in signals.py delete it.
+Deleting it only works when every process uses the same cache, so without CACHE_SHARED
+the timeout is 0 and the confirmation is rendered every time.
+"""
+
+FRAGMENT_NAME = 'order_confirmation'
+
+
+def forget_confirmations(order_numbers):
+    """Delete the cached confirmation of these orders, so they're rendered again"""
+    cache.delete_many([make_template_fragment_key(FRAGMENT_NAME, [number]) for number in order_numbers])
+
+
+def forget_confirmation_of(order_id, order=None):
+    """forget_confirmations for a line item's order, which is often only an order_id.
+    The order number is only looked up when confirmations are cached at all,
+    pass the order if it's already loaded so it isn't looked up again"""
+    if not settings.ORDER_CONFIRMATION_CACHE_TIMEOUT:
+        return  # nothing was cached
+    if order is not None:
+        forget_confirmations([order.order_number])
+    else:
+        forget_confirmations(Order.objects.filter(pk=order_id).values_list('order_number', flat=True))
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+"""
+An outbox for the emails we send to customers.
+
+Sending an email straight from the webhook handler meant waiting for the SMTP server,
+and a slow server could make the webhook so slow that Stripe sent it again.
+Now the handler only adds a row to the outbox (in the same transaction as the order),
+and the mailer process (manage.py send_outbox_emails, the mailer line in the Procfile)
+sends what's in it, many emails over one SMTP connection.
+"""
+
+RETRY_DELAY = timedelta(seconds=30)  # doubled after every failed attempt
+LEASE = timedelta(minutes=10)  # how long claimed emails are left to the mailer that claimed them
+MAX_ATTEMPTS = 8  # about two hours of retrying
+
+# the subject and body templates for each kind of email
+TEMPLATES = {
+    OutboxEmail.ORDER_CONFIRMATION: (
+        'checkout/confirmation_emails/confirmation_email_subject.txt',
+        'checkout/confirmation_emails/confirmation_email_body.txt',
+    ),
+}
+
+
+def queue_email(order, kind=OutboxEmail.ORDER_CONFIRMATION):
+    """Add an email for the order to the outbox, unless it's there already"""
+    email, created = OutboxEmail.objects.get_or_create(order=order, kind=kind)
+    return created
+
+
+def claim_emails(batch_size):
+    """
+    Lease the emails that are due, oldest first, like webhook_queue.claim_jobs: their run_after is
+    moved LEASE ahead in a short transaction of its own, so no transaction is open and no row is
+    locked while the mail server is slow. Emails of a mailer that died are sent when the lease runs out.
+    On Postgres the rows are locked and skipped by other mailers while they're being leased.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = OutboxEmail.objects.filter(
+            status=OutboxEmail.PENDING, run_after__lte=now,
+        ).select_related('order').order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            emails = emails.select_for_update(skip_locked=True, of=('self',))
+        emails = list(emails[:batch_size])
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(run_after=now + LEASE)
+    return emails
+
+
+def render_email(email):
+    """The EmailMessage for an outbox row, rendered from its templates"""
+    subject_template, body_template = TEMPLATES[email.kind]
+    order = email.order
+    subject = render_to_string(subject_template, {'order': order})
+    body = render_to_string(body_template, {'order': order, 'contact_email': settings.DEFAULT_FROM_EMAIL})
+    return EmailMessage(subject.strip(), body, settings.DEFAULT_FROM_EMAIL, [order.email])
+
+
+def send_emails(emails):
+    """
+    Send the emails over one connection to the mail server and store the outcome on each one
+    as soon as it's known (its own small transaction), so an email that was sent isn't sent again
+    when a later one hangs or the mailer stops. One email failing doesn't stop the others,
+    it's tried again later.
+    """
+    now = timezone.now()
+    for email in emails:
+        email.attempts += 1
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as e:
+        # no connection at all, nothing could be sent
+        for email in emails:
+            _failed(email, now, str(e))
+            _save(email)
+    else:
+        try:
+            for email in emails:
+                try:
+                    mail_connection.send_messages([render_email(email)])
+                except Exception as e:
+                    _failed(email, now, str(e))
+                else:
+                    email.status = OutboxEmail.SENT
+                    email.sent = timezone.now()
+                    email.error = ''
+                _save(email)
+        finally:
+            mail_connection.close()
+    return emails
+
+
+def send_batch(batch_size):
+    """Send one batch of due emails, returns them"""
+    emails = claim_emails(batch_size)
+    if emails:
+        send_emails(emails)
+    return emails
+
+
+def _save(email):
+    email.save(update_fields=['status', 'attempts', 'run_after', 'sent', 'error'])
+
+
+def _failed(email, now, error):
+    """Try again later with a growing delay, or give up after MAX_ATTEMPTS attempts"""
+    email.error = error
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+    else:
+        email.run_after = now + RETRY_DELAY * 2 ** max(email.attempts - 1, 0)
@@ -0,0 +1,98 @@
+import json
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from checkout.models import Order
+from products.benchmarking import rolled_back
+
+COUNTRIES = ('GB', 'IE', 'US', 'DE', 'FR', 'NL', 'ES', 'IT')
+STREETS = ('High Street', 'Station Road', 'Main Street', 'Park Road', 'Church Lane', 'Mill Lane')
+TOWNS = ('London', 'Dublin', 'Leeds', 'Bristol', 'Cork', 'Glasgow', 'York', 'Bath')
+
+
+class Command(BaseCommand):
+    help = ('Seed a large order history and compare the old webhook order lookup (every field __iexact) '
+            'with the lookup on the unique stripe_pid. Nothing is kept in the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--lookups', type=int, default=20, help='how many random orders to look up')
+
+    def handle(self, *args, **options):
+        with rolled_back():  # the seeded orders
+            orders = self._seed(options['orders'])
+            sample = random.Random(7).sample(orders, min(options['lookups'], len(orders)))
+
+            self.stdout.write(self.style.MIGRATE_HEADING('Query plans'))
+            self.stdout.write(f'all fields: {self._all_fields(sample[0]).explain()}')
+            self.stdout.write(f'stripe_pid: {self._by_pid(sample[0]).explain()}')
+
+            old = self._time(lambda order: self._all_fields(order).get(), sample)
+            new = self._time(lambda order: self._by_pid(order).get(), sample)
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{len(sample)} lookups'))
+            self.stdout.write(f'all fields __iexact {old * 1000:10.2f} ms per lookup')
+            self.stdout.write(f'stripe_pid          {new * 1000:10.2f} ms per lookup')
+
+    def _seed(self, count):
+        """Create count orders without line items, returns the field values of each one"""
+        rng = random.Random(42)  # same orders every run
+        started = time.perf_counter()
+        orders = []
+        batch = []
+        for i in range(count):
+            bag = json.dumps({str(rng.randint(1, 150)): rng.randint(1, 3)})
+            order = Order(
+                order_number=uuid.UUID(int=rng.getrandbits(128)).hex.upper(),  # bulk_create doesn't call save()
+                full_name=f'Customer {i}',
+                email=f'customer{i}@example.com',
+                phone_number=f'07{rng.randrange(10 ** 9):09d}',
+                country=rng.choice(COUNTRIES),
+                postcode=f'PC{rng.randrange(10000)}',
+                town_or_city=rng.choice(TOWNS),
+                street_address1=f'{rng.randint(1, 200)} {rng.choice(STREETS)}',
+                street_address2=None,
+                county=None,
+                order_total=rng.randint(1000, 50000) / 100,
+                original_bag=bag,
+                stripe_pid=f'pi_bench{i:010d}',
+            )
+            order.grand_total = order.order_total
+            batch.append(order)
+            orders.append(order)
+            if len(batch) == 10000:
+                Order.objects.bulk_create(batch)
+                batch = []
+        Order.objects.bulk_create(batch)
+        self.stdout.write(f'Seeded {count} orders in {time.perf_counter() - started:.1f}s')
+        return orders
+
+    def _all_fields(self, order):
+        """The lookup the webhook handler used to do"""
+        return Order.objects.filter(
+            full_name__iexact=order.full_name,
+            email__iexact=order.email,
+            phone_number__iexact=order.phone_number,
+            country__iexact=order.country,
+            postcode__iexact=order.postcode,
+            town_or_city__iexact=order.town_or_city,
+            street_address1__iexact=order.street_address1,
+            street_address2__iexact=order.street_address2,
+            county__iexact=order.county,
+            grand_total=order.grand_total,
+            original_bag=order.original_bag,
+            stripe_pid=order.stripe_pid,
+        )
+
+    def _by_pid(self, order):
+        """The lookup the webhook handler does now, see webhook_handler.py"""
+        return Order.objects.filter(stripe_pid=order.stripe_pid).exclude(stripe_pid='')
+
+    def _time(self, lookup, orders):
+        """Average time of one lookup, in seconds"""
+        started = time.perf_counter()
+        for order in orders:
+            lookup(order)
+        return (time.perf_counter() - started) / len(orders)
@@ -0,0 +1,68 @@
+import hashlib
+import hmac
+import json
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from checkout.models import WebhookJob
+
+
+class Command(BaseCommand):
+    help = ('Send a burst of signed payment_intent.succeeded webhooks to the webhook view '
+            'and report how long each one keeps a web worker busy. The queued jobs are '
+            'deleted afterwards, the worker never handles them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        payloads = [self._payload(f'evt_loadtest_{run_id}_{i}') for i in range(options['requests'])]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(self._send, payloads))
+        wall = time.perf_counter() - started
+
+        statuses = {status for status, _ in timings}
+        busy = sorted(seconds for _, seconds in timings)
+        self.stdout.write(f'{len(busy)} webhooks in {wall:.2f}s with {options["concurrency"]} threads, '
+                          f'statuses {sorted(statuses)}')
+        self.stdout.write(f'worker time per webhook: median {statistics.median(busy) * 1000:.1f} ms, '
+                          f'p95 {busy[int(len(busy) * 0.95) - 1] * 1000:.1f} ms, '
+                          f'max {busy[-1] * 1000:.1f} ms')
+        self.stdout.write(f'total worker time {sum(busy):.2f}s, '
+                          f'average busy workers {sum(busy) / wall:.2f}')
+        self.stdout.write('(the old handler slept up to 5s per webhook when the order was missing)')
+
+        WebhookJob.objects.filter(event_id__startswith=f'evt_loadtest_{run_id}_').delete()
+
+    def _payload(self, event_id):
+        return json.dumps({
+            'id': event_id,
+            'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': f'pi_{event_id}', 'object': 'payment_intent', 'metadata': {}}},
+        })
+
+    def _send(self, payload):
+        """Post one webhook signed like Stripe does, returns (status, seconds)"""
+        timestamp = int(time.time())
+        signature = hmac.new(settings.STRIPE_WH_SECRET.encode(), f'{timestamp}.{payload}'.encode(),
+                             hashlib.sha256).hexdigest()
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        started = time.perf_counter()
+        response = client.post(reverse('webhook'), payload, content_type='application/json',
+                               HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+        seconds = time.perf_counter() - started
+        connection.close()  # every thread has its own connection
+        return response.status_code, seconds
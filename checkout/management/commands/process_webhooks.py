@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout.webhook_queue import claim_jobs, process_job
+
+
+class Command(BaseCommand):
+    help = 'Handle the queued Stripe webhooks (runs as the worker process in the Procfile)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='handle the jobs that are due now and stop')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help='seconds to wait when there is nothing to do')
+
+    def handle(self, *args, **options):
+        while True:
+            handled = self.run_batch(options['batch_size'])
+            if options['once'] and not handled:
+                break
+            if not handled:
+                time.sleep(options['poll_interval'])
+
+    def run_batch(self, batch_size):
+        """Handle one batch of due jobs, returns how many there were"""
+        jobs = claim_jobs(batch_size)
+        for job in jobs:
+            process_job(job)  # in a transaction per job, see claim_jobs
+            self.stdout.write(f'{job} attempt {job.attempts}: {job.result}')
+        return len(jobs)
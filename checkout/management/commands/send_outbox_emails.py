@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout.email_outbox import send_batch
+
+
+class Command(BaseCommand):
+    help = 'Send the emails in the outbox (runs as the mailer process in the Procfile)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='send the emails that are due now and stop')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='emails sent over one connection to the mail server')
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='seconds to wait when there is nothing to send')
+
+    def handle(self, *args, **options):
+        while True:
+            emails = send_batch(options['batch_size'])
+            for email in emails:
+                self.stdout.write(f'{email} attempt {email.attempts}{": " + email.error if email.error else ""}')
+            if options['once'] and not emails:
+                break
+            if not emails:
+                time.sleep(options['poll_interval'])
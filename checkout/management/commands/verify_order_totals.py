@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from checkout.confirmation_cache import forget_confirmations
+from checkout.models import Order
+from checkout.order_totals import drifted_orders
+
+
+class Command(BaseCommand):
+    help = ('Compare the totals of every order with its line items, and with --fix '
+            'correct the ones that drifted. Meant to run now and then (Heroku Scheduler).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='save the correct totals')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted = drifted_orders().order_by('pk').values(
+            'pk', 'order_number', 'order_total', 'grand_total', 'expected_total',
+            'expected_delivery', 'expected_grand_total')
+
+        found = 0
+        last_pk = 0
+        while True:
+            # a batch at a time, by pk, so fixing a batch doesn't disturb the query for the next one
+            rows = list(drifted.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not rows:
+                break
+            last_pk = rows[-1]['pk']
+            found += len(rows)
+            for row in rows:
+                self.stdout.write(
+                    f'{row["order_number"]}: total {row["order_total"]} should be {row["expected_total"]}, '
+                    f'grand total {row["grand_total"]} should be {row["expected_grand_total"]}')
+            if options['fix']:
+                with transaction.atomic():
+                    Order.objects.bulk_update([
+                        Order(pk=row['pk'],
+                              order_total=row['expected_total'],
+                              delivery_cost=row['expected_delivery'],
+                              grand_total=row['expected_grand_total'])
+                        for row in rows
+                    ], ['order_total', 'delivery_cost', 'grand_total'])
+                forget_confirmations([row['order_number'] for row in rows])  # bulk_update sends no signals
+
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Fixed {found} orders'))
+        else:
+            self.stdout.write(f'{found} orders drifted' + (', run with --fix to correct them' if found else ''))
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_payments(apps, schema_editor):
+    """
+    The old webhook created a second order when it couldn't match every field of the first one,
+    so there can be orders sharing a stripe_pid. The oldest keeps it, the others get the order id
+    added so the unique constraint can be created and nothing is deleted.
+    """
+    Order = apps.get_model('checkout', 'Order')
+    duplicates = (Order.objects.exclude(stripe_pid='').values('stripe_pid')
+                  .annotate(orders=Count('id')).filter(orders__gt=1).values_list('stripe_pid', flat=True))
+    for pid in list(duplicates):
+        for order in Order.objects.filter(stripe_pid=pid).order_by('date', 'id')[1:]:
+            order.stripe_pid = f'{pid}-duplicate-{order.id}'
+            order.save(update_fields=['stripe_pid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0005_webhookjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_payments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_pid', ''), _negated=True), fields=('stripe_pid',), name='unique_order_stripe_pid'),
+        ),
+    ]
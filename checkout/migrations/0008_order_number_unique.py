@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:26
+
+import checkout.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0007_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.CharField(default=checkout.models.generate_order_number, editable=False, max_length=32, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0008_order_number_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_profile', 'date', 'id'], name='order_history_idx'),
+        ),
+    ]
@@ -1,8 +1,11 @@
-import uuid  # used for generating order number
+import secrets  # used for generating order number
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
 
 from django.db import models
 from django.db.models import Sum
 from django.conf import settings
+from django.utils import timezone
 
 from django_countries.fields import CountryField
 
@@ -10,8 +13,57 @@ from products.models import Product
 from profiles.models import UserProfile
 # Create your models here.
 
+CENT = Decimal('0.01')
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # no I, L, O or U so it's easy to read out on the phone
+
+
+def generate_order_number():
+    """
+    A ULID: the time in milliseconds (48 bits) followed by 80 random bits, as 26 characters of base32.
+    Order numbers made later sort after earlier ones, so new rows go at the end of the
+    order_number index instead of at a random place in it like a uuid4 did.
+    """
+    value = (int(time.time() * 1000) << 80) | secrets.randbits(80)
+    chars = []
+    for _ in range(26):
+        value, index = divmod(value, 32)
+        chars.append(CROCKFORD_BASE32[index])
+    return ''.join(reversed(chars))
+
+
+def totals_for(order_total):
+    """
+    The delivery cost and grand total for an order (or bag) total.
+    Delivery is STANDARD_DELIVERY_PERCENTAGE of the total below FREE_DELIVERY_THRESHOLD.
+    Both are worked out on the exact amounts and rounded to cents half to even, the way a DecimalField
+    rounds when it's saved. That's what orders have always been saved with, and bag_contents uses it
+    for the amount Stripe charges, so the order and the payment agree. order_totals.py does it in SQL.
+    """
+    order_total = Decimal(order_total)
+    delivery = Decimal(0)
+    if order_total < settings.FREE_DELIVERY_THRESHOLD:
+        delivery = order_total * settings.STANDARD_DELIVERY_PERCENTAGE / 100
+    return (delivery.quantize(CENT, rounding=ROUND_HALF_EVEN),
+            (order_total + delivery).quantize(CENT, rounding=ROUND_HALF_EVEN))
+
+
 class Order(models.Model):
-    order_number = models.CharField(max_length=32, null=False, editable=False)
+    class Meta:
+        constraints = [
+            # the webhook finds the order for a payment on stripe_pid, the unique index makes that one lookup.
+            # Orders made in the admin have no payment (an empty stripe_pid) so those are left out.
+            models.UniqueConstraint(fields=['stripe_pid'], condition=~models.Q(stripe_pid=''),
+                                    name='unique_order_stripe_pid'),
+        ]
+        indexes = [
+            # the order history on the profile page, newest first (see profiles/views.py)
+            models.Index(fields=['user_profile', 'date', 'id'], name='order_history_idx'),
+        ]
+
+    # unique, so checkout_success and the order history find an order with one index lookup.
+    # Older orders have a 32 character uuid, new ones a 26 character ULID.
+    order_number = models.CharField(max_length=32, null=False, editable=False, unique=True,
+                                    default=generate_order_number)
     """We'll use models.SET_NULL if the profile is deleted since that will allow us to keep
         an order history in the admin even if the user is deleted.
         And will also allow this to be either null or blank so that users who don't have an
@@ -39,9 +91,9 @@ class Order(models.Model):
 
     def _generate_order_number(self):
         """
-        Generates order number using UUID
+        Generates order number, a ULID (see generate_order_number)
         """
-        return uuid.uuid4().hex.upper()
+        return generate_order_number()
     
     def update_total(self):
         """
@@ -49,11 +101,7 @@ class Order(models.Model):
         for delivery costs
         """
         self.order_total = self.lineitems.aggregate(Sum('lineitem_total'))['lineitem_total__sum'] or 0  # This will prevent an error if we manually delete all the line items from an order by making sure that this sets the order total to zero instead of none.
-        if self.order_total < settings.FREE_DELIVERY_THRESHOLD:
-            self.delivery_cost = self.order_total * settings.STANDARD_DELIVERY_PERCENTAGE/100
-        else:
-            self.delivery_cost = 0
-        self.grand_total = self.order_total + self.delivery_cost
+        self.delivery_cost, self.grand_total = totals_for(self.order_total)
         self.save()
 
     
@@ -80,11 +128,88 @@ class OrderLineItem(models.Model):
     def save(self, *args, **kwargs):
         """Override default save method to set the lineitem total and update order total
         """
-        self.lineitem_total = self.product.price * self.quantity
+        self.lineitem_total = self.calculate_total()
         super().save(*args, **kwargs)
+
+    def calculate_total(self):
+        """The price of the product times the quantity"""
+        return self.product.price * self.quantity
     
     def __str__(self):
         return f'SKU {self.product.sku} on order {self.order.order_number}'
-    
 
-    
\ No newline at end of file
+
+class WebhookJob(models.Model):
+    """
+    A Stripe webhook waiting to be handled.
+    The webhook view only saves the event here and answers Stripe straight away,
+    manage.py process_webhooks does the actual work (finding or creating the order).
+    """
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='webhookjob_queue_idx'),  # the worker's query
+        ]
+
+    event_id = models.CharField(max_length=254, unique=True)  # Stripe can send the same event more than once
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField()  # the event json exactly as Stripe sent it
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # not picked up by the worker before this time
+    created = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    result = models.TextField(blank=True, default='')  # the handler's response or the error
+
+    def __str__(self):
+        return f'{self.event_type} {self.event_id} ({self.status})'
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent.
+    The webhook worker only adds a row here, manage.py send_outbox_emails renders
+    and sends them in batches over one SMTP connection.
+    """
+    ORDER_CONFIRMATION = 'order_confirmation'
+    KIND_CHOICES = [
+        (ORDER_CONFIRMATION, 'Order confirmation'),
+    ]
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    class Meta:
+        constraints = [
+            # one confirmation per order, even when Stripe sends the webhook more than once
+            models.UniqueConstraint(fields=['order', 'kind'], name='unique_outbox_email_per_order'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='outboxemail_queue_idx'),  # the worker's query
+        ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='emails')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES, default=ORDER_CONFIRMATION)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # not sent by the worker before this time
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')  # the last SMTP error
+
+    def __str__(self):
+        return f'{self.get_kind_display()} for order {self.order.order_number} ({self.status})'
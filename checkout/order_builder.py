@@ -0,0 +1,57 @@
+from .models import OrderLineItem
+from .order_totals import incremental, apply_delta, refresh_totals
+from products.models import Product
+from bag.contexts import drop_missing_products
+
+"""
+Creating the line items of a new order from the bag.
+
+Saving line items one by one sends post_save for each of them, and the receiver in signals.py
+recalculates (and saves) the whole order every time. For a new order we know all the
+line items up front, so we get the products in one query, insert all line items in one
+bulk_create (which doesn't send signals) and update the order total once.
+Editing line items in the admin still goes through save() and the signals.
+"""
+
+
+def create_line_items(order, bag):
+    """
+    Create the line items for the bag (as it is in the session) on an order that's already saved,
+    call this inside transaction.atomic() together with saving the order so nothing is left behind.
+
+    A product that isn't in the database anymore is left out of the order, like bag_contents
+    leaves it out of the bag. By now the customer has paid, so an order without that product
+    (that the webhook handler flags because its total doesn't match the payment) is better than
+    no order at all. Returns the line items and the ids of the products that were left out.
+    """
+    bag = dict(bag)  # a copy, the products that are left out stay in the caller's bag
+    products = Product.objects.in_bulk(bag.keys())
+    missing = drop_missing_products(bag, products)
+
+    line_items = []
+    for item_id, item_data in bag.items():
+        product = products[int(item_id)]
+
+        if isinstance(item_data, int):
+            quantities = {None: item_data}  # no sizes, the item data is just the quantity
+        else:
+            quantities = item_data['items_by_size']
+
+        for size, quantity in quantities.items():
+            order_line_item = OrderLineItem(
+                order=order,
+                product=product,
+                quantity=quantity,
+                product_size=size,
+            )
+            order_line_item.lineitem_total = order_line_item.calculate_total()
+            line_items.append(order_line_item)
+
+    OrderLineItem.objects.bulk_create(line_items)
+    if incremental():
+        # the order is new so its totals are still 0, the delta is the sum of the line items
+        apply_delta(order.pk, sum(line_item.lineitem_total for line_item in line_items))
+        refresh_totals(order)
+    else:
+        order.update_total()
+    return line_items, missing
@@ -0,0 +1,100 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Func, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Mod
+
+from .models import Order, OrderLineItem
+
+"""
+Keeping the totals on the order up to date in the database.
+
+Order.update_total sums every line item of the order and then saves the whole order.
+With ORDER_TOTALS_MODE = 'incremental' (settings.py) a line item that is added, changed or
+deleted only adds the difference to the totals, in a single UPDATE of the three total columns.
+It's done with F() expressions so two line items changing at the same time can't overwrite
+each other's totals.
+
+manage.py verify_order_totals compares the totals with the line items and fixes the
+orders that drifted (like when a line item was changed with update(), which sends no signals).
+"""
+
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+
+def incremental():
+    return settings.ORDER_TOTALS_MODE == 'incremental'
+
+
+def round_money(expression):
+    """ROUND(expression, 2), SQLite calculates with floats so the totals are rounded to cents"""
+    return Func(expression, Value(2), function='ROUND', output_field=MONEY)
+
+
+def _round_half_even(hundredths):
+    """
+    An amount in hundredths of a cent (a whole number) rounded to cents half to even, as money.
+    SQL's ROUND rounds a half up, so when the cents below it are even we take one hundredth off
+    first: 122.50 cents becomes 122, 123.50 still becomes 124. MOD instead of FLOOR, SQLite
+    doesn't always have FLOOR.
+    """
+    cents_below = (hundredths - Mod(hundredths, 100)) / 100
+    cents = Func((hundredths - 1 + Mod(cents_below, 2)) / 100, function='ROUND', output_field=MONEY)
+    return ExpressionWrapper(cents / 100, output_field=MONEY)
+
+
+def totals(order_total, below_threshold):
+    """
+    The delivery cost and grand total like models.totals_for (and so Order.update_total and the bag),
+    but as SQL expressions, rounded half to even the same way.
+    below_threshold is a Q that is true when order_total is below the free delivery threshold.
+    Worked out in hundredths of a cent, which are whole numbers as long as
+    STANDARD_DELIVERY_PERCENTAGE is, so nothing depends on float rounding.
+    """
+    cents = Func(order_total * 100, function='ROUND', output_field=MONEY)  # a whole number, even on SQLite
+    delivery_hundredths = Case(
+        When(below_threshold, then=cents * settings.STANDARD_DELIVERY_PERCENTAGE),
+        default=Value(0),
+        output_field=MONEY,
+    )
+    return _round_half_even(delivery_hundredths), _round_half_even(cents * 100 + delivery_hundredths)
+
+
+def apply_delta(order_id, delta):
+    """Add delta to the order total and recalculate delivery and grand total, in one UPDATE"""
+    if not delta:
+        return
+    order_total = round_money(F('order_total') + delta)
+    # in an UPDATE every column still has its old value on the right side,
+    # so 'the new total is below the threshold' is 'the old total is below the threshold - delta'
+    delivery, grand_total = totals(order_total, Q(order_total__lt=settings.FREE_DELIVERY_THRESHOLD - delta))
+    Order.objects.filter(pk=order_id).update(
+        order_total=order_total,
+        delivery_cost=delivery,
+        grand_total=grand_total,
+    )
+
+
+def refresh_totals(order):
+    """Read the totals apply_delta wrote back into an order we have in memory"""
+    order.refresh_from_db(fields=['order_total', 'delivery_cost', 'grand_total'])
+
+
+def with_expected_totals(orders):
+    """Annotate the totals the orders should have going by their line items"""
+    line_items_total = OrderLineItem.objects.filter(order=OuterRef('pk')).order_by().values('order') \
+        .annotate(total=Sum('lineitem_total')).values('total')
+    orders = orders.annotate(
+        expected_total=round_money(Coalesce(Subquery(line_items_total, output_field=MONEY), Value(Decimal('0.00')))))
+    delivery, grand_total = totals(F('expected_total'), Q(expected_total__lt=settings.FREE_DELIVERY_THRESHOLD))
+    return orders.annotate(expected_delivery=delivery, expected_grand_total=grand_total)
+
+
+def drifted_orders(orders=None):
+    """The orders whose totals don't match their line items"""
+    orders = with_expected_totals(Order.objects.all() if orders is None else orders)
+    return orders.exclude(
+        order_total=F('expected_total'),
+        delivery_cost=F('expected_delivery'),
+        grand_total=F('expected_grand_total'),
+    )
@@ -1,14 +1,34 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_init, post_save, post_delete
 
 from django.dispatch import receiver
 
-from .models import OrderLineItem
+from .models import Order, OrderLineItem
+from .order_totals import incremental, apply_delta, refresh_totals
+from .confirmation_cache import forget_confirmations, forget_confirmation_of
 
 """So this implies these signals are sent by django to the entire application
 after a model instance is saved and after it's deleted respectively.
 To receive these signals we can import receiver from django.dispatch.
 Of course since we'll be listening for signals from the OrderLineItem model"""
 
+@receiver(post_init, sender=OrderLineItem)
+def remember_saved_total(sender, instance, **kwargs):
+    """The line item total and order as they are in the database, so after a save
+    we know how much the order total changed (only used with ORDER_TOTALS_MODE incremental).
+    Read from __dict__ so a line item loaded with only() doesn't make a query for them,
+    the total is None then and the order is recalculated instead."""
+    if 'lineitem_total' in instance.__dict__ and 'order_id' in instance.__dict__:
+        instance._saved_total = instance.lineitem_total or 0
+    else:
+        instance._saved_total = None
+    instance._saved_order_id = instance.__dict__.get('order_id')
+
+
+def _loaded_order(line_item):
+    """The line item's order if it's already in memory, without a query for it"""
+    return line_item.order if OrderLineItem.order.is_cached(line_item) else None
+
+
 # Now to execute this function anytime the post_save signal is sent.
 # I'll use the receiver decorator. Telling it we're receiving post saved signals.
 # From the OrderLineItem model.
@@ -20,7 +40,20 @@ def update_on_save(sender, instance, created, **kwargs):
     A boolean sent by django referring to whether this is a new instance or one being updated.
     And any keyword arguments.
     """
-    instance.order.update_total()
+    forget_confirmation_of(instance.order_id, _loaded_order(instance))
+    if not incremental() or (instance._saved_total is None and not created):
+        instance.order.update_total()
+        return
+
+    saved_total = 0 if created else instance._saved_total
+    if instance._saved_order_id not in (None, instance.order_id):
+        apply_delta(instance._saved_order_id, -saved_total)  # moved to another order
+        saved_total = 0
+    apply_delta(instance.order_id, instance.lineitem_total - saved_total)
+    if OrderLineItem.order.is_cached(instance):
+        refresh_totals(instance.order)  # so the order we have in memory doesn't save old totals later
+    instance._saved_total = instance.lineitem_total
+    instance._saved_order_id = instance.order_id
 
 @receiver(post_delete, sender=OrderLineItem)
 def update_on_delete(sender, instance, **kwargs):
@@ -29,4 +62,15 @@ def update_on_delete(sender, instance, **kwargs):
     We can just copy the whole function. Change the signal,
     And remove the created parameter because it's not sent by this signal.
     """
-    instance.order.update_total()
+    forget_confirmation_of(instance.order_id, _loaded_order(instance))
+    if not incremental() or instance._saved_total is None:
+        instance.order.update_total()
+        return
+    apply_delta(instance._saved_order_id, -instance._saved_total)
+
+
+@receiver(post_save, sender=Order)
+def forget_confirmation_on_save(sender, instance, created, **kwargs):
+    """An order changed in the admin, its cached confirmation (see confirmation_cache.py) is out of date"""
+    if not created:
+        forget_confirmations([instance.order_number])
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+import requests
+import stripe
+
+from boutique_ado.middleware import record_stripe_call
+
+"""
+One Stripe client for the whole process.
+
+The views used to set stripe.api_key and call stripe.PaymentIntent.create etc., which opened
+a new HTTPS connection (DNS, TCP and TLS handshakes) for most calls. Here all the calls go through
+one requests.Session, so the connections to Stripe are kept open and reused.
+
+Every kind of call (operation) has its own timeout (STRIPE_TIMEOUTS in settings.py) and we keep
+count of how many calls there were and how long they took. Every STRIPE_METRICS_LOG_INTERVAL
+seconds (when there were calls) those numbers are written as one JSON log line
+(logger boutique_ado.stripe) and counted again from zero, so every web worker and the
+webhook worker log their own, like
+{"stripe": {"payment_intent.create": {"calls": 12, "errors": 0, "total_ms": 4120.5, "max_ms": 802.1, "mean_ms": 343.4}}}
+
+STRIPE_API_BASE points the client at another server, like stripe-mock or a fake Stripe
+server in a test, instead of api.stripe.com.
+
+The async views (ASYNC_VIEWS in settings.py) call Stripe with in_thread_pool(), so the event
+loop keeps serving other requests while a thread waits for Stripe.
+"""
+
+logger = logging.getLogger('boutique_ado.stripe')
+
+_lock = threading.Lock()
+_session = None
+_clients = {}  # one StripeClient per timeout, they all share the session
+_metrics = {}
+_metrics_since = time.monotonic()  # when the metrics were last logged
+_executor = None  # threads for the async views, one per pooled connection
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=settings.STRIPE_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _session = session
+    return _session
+
+
+def get_client(operation):
+    """The StripeClient with the timeout for this operation"""
+    timeout = settings.STRIPE_TIMEOUTS.get(operation, settings.STRIPE_TIMEOUTS['default'])
+    client = _clients.get(timeout)
+    if client is None:
+        with _lock:
+            client = _clients.get(timeout)
+            if client is None:
+                base_addresses = {'api': settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {}
+                client = stripe.StripeClient(
+                    settings.STRIPE_SECRET_KEY,
+                    base_addresses=base_addresses,
+                    max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                    http_client=stripe.RequestsClient(timeout=timeout, session=_get_session()),
+                )
+                _clients[timeout] = client
+    return client
+
+
+def _call(operation, func, *args, **kwargs):
+    """Run one Stripe call and record how long it took"""
+    started = time.perf_counter()
+    failed = False
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        _record(operation, seconds, failed)
+        record_stripe_call(seconds)  # for the Server-Timing header of this request
+
+
+def _record(operation, seconds, failed):
+    global _metrics_since
+    with _lock:
+        metric = _metrics.setdefault(operation, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        metric['calls'] += 1
+        metric['errors'] += failed
+        metric['total_ms'] += seconds * 1000
+        metric['max_ms'] = max(metric['max_ms'], seconds * 1000)
+
+        if time.monotonic() - _metrics_since < settings.STRIPE_METRICS_LOG_INTERVAL:
+            return
+        metrics = {operation: dict(metric) for operation, metric in _metrics.items()}
+        _metrics.clear()
+        _metrics_since = time.monotonic()
+    log_metrics(metrics)
+
+
+def log_metrics(metrics):
+    """Write the metrics of the last interval as one log line (outside the lock, logging can be slow)"""
+    for metric in metrics.values():
+        metric['total_ms'] = round(metric['total_ms'], 1)
+        metric['max_ms'] = round(metric['max_ms'], 1)
+        metric['mean_ms'] = round(metric['total_ms'] / metric['calls'], 1)
+    logger.info(json.dumps({'stripe': metrics}))
+
+
+def stripe_metrics():
+    """Calls, errors, total and max time (in ms) of every operation since they were last logged or reset_metrics()"""
+    with _lock:
+        return {operation: dict(metric) for operation, metric in _metrics.items()}
+
+
+def reset_metrics():
+    with _lock:
+        _metrics.clear()
+
+
+def reset_clients():
+    """Make new clients on the next call, after the Stripe settings were changed (benchmark_storefront does this)"""
+    with _lock:
+        _clients.clear()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(settings.STRIPE_POOL_SIZE, thread_name_prefix='stripe')
+    return _executor
+
+
+async def in_thread_pool(func, *args, **kwargs):
+    """
+    await one of the calls below from an async view, like
+    await in_thread_pool(modify_payment_intent, pid, metadata=...)
+    The Stripe library blocks while it waits for an answer, so it runs in a thread of its own.
+    Only for Stripe calls: they don't touch the database, anything that does needs sync_to_async.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # run_in_executor doesn't pass it on, the timing middleware needs it
+    return await loop.run_in_executor(_get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+def create_payment_intent(**params):
+    client = get_client('payment_intent.create')
+    return _call('payment_intent.create', client.payment_intents.create, params=params)
+
+
+def retrieve_payment_intent(intent_id):
+    client = get_client('payment_intent.retrieve')
+    return _call('payment_intent.retrieve', client.payment_intents.retrieve, intent_id)
+
+
+def modify_payment_intent(intent_id, **params):
+    client = get_client('payment_intent.modify')
+    return _call('payment_intent.modify', client.payment_intents.update, intent_id, params=params)
+
+
+def retrieve_charge(charge_id):
+    client = get_client('charge.retrieve')
+    return _call('charge.retrieve', client.charges.retrieve, charge_id)
@@ -1,3 +1,273 @@
-from django.test import TestCase
+import io
+import json
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage import default_storage
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, stripe_client
+from .email_outbox import LEASE as EMAIL_LEASE, claim_emails, queue_email, send_emails
+from .models import Order, OrderLineItem, OutboxEmail, WebhookJob, totals_for
+from .order_builder import create_line_items
+from .order_totals import drifted_orders
+from .webhook_queue import LEASE, claim_jobs, enqueue, process_job
+from products.models import Product
+
+
+def create_order(**fields):
+    return Order.objects.create(**{
+        'full_name': 'Test Customer', 'email': 'test@example.com', 'phone_number': '0123', 'country': 'GB',
+        'town_or_city': 'Leeds', 'street_address1': '1 High Street', **fields,
+    })
+
+
+class CreateLineItemsTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(sku='order-test-1', name='Denim Jacket', description='', price='60.00')
+        deleted = Product.objects.create(sku='order-test-2', name='Old Scarf', description='', price='5.00')
+        self.deleted_id = str(deleted.id)
+        deleted.delete()
+
+    def test_deleted_product_is_left_out_of_the_order(self):
+        bag = {str(self.product.id): 1, self.deleted_id: 3}
+        order = create_order(original_bag=json.dumps(bag), stripe_pid='pi_test')
+
+        line_items, missing = create_line_items(order, bag)
+
+        self.assertEqual(missing, [self.deleted_id])
+        self.assertEqual([line_item.product for line_item in line_items], [self.product])
+        self.assertIn(self.deleted_id, bag)  # the caller's bag isn't changed
+        order.refresh_from_db()
+        self.assertEqual(order.lineitems.count(), 1)
+        self.assertEqual(order.order_total, Decimal('60.00'))
+
+
+class WebhookQueueTests(TestCase):
+
+    def _queue(self, event_id, event_type='payment_intent.payment_failed'):
+        event = {'id': event_id, 'object': 'event', 'type': event_type,
+                 'data': {'object': {'id': 'pi_test', 'object': 'payment_intent'}}}
+        enqueue(event, json.dumps(event))
+
+    def test_claimed_jobs_are_leased(self):
+        self._queue('evt_test_1')
+        self._queue('evt_test_2')
+
+        self.assertEqual(len(claim_jobs(1)), 1)
+        self.assertEqual([job.event_id for job in claim_jobs(10)], ['evt_test_2'])  # the first one is leased
+        self.assertEqual(claim_jobs(10), [])
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + LEASE):
+            self.assertEqual(len(claim_jobs(10)), 2)  # the lease ran out, a worker must have died
+
+    def test_process_webhooks_handles_the_queue(self):
+        self._queue('evt_test_1')
+        self._queue('evt_test_2', 'customer.created')
+
+        call_command('process_webhooks', '--once', stdout=io.StringIO())
+
+        self.assertEqual(WebhookJob.objects.filter(status=WebhookJob.DONE).count(), 2)
+
+    def test_stripe_is_called_outside_the_jobs_transaction(self):
+        order = create_order(stripe_pid='pi_test_paid', original_bag='{}', grand_total=Decimal('10.00'))
+        address = {'country': 'GB', 'postal_code': '', 'city': 'Leeds', 'line1': '1 High Street',
+                   'line2': '', 'state': ''}
+        event = {'id': 'evt_test_paid', 'object': 'event', 'type': 'payment_intent.succeeded',
+                 'data': {'object': {
+                     'id': 'pi_test_paid', 'object': 'payment_intent', 'latest_charge': 'ch_test',
+                     'metadata': {'bag': '{}', 'save_info': '', 'username': 'AnonymousUser'},
+                     'shipping': {'name': 'Test Customer', 'phone': '0123', 'address': address}}}}
+        enqueue(event, json.dumps(event))
+        depth = len(connection.savepoint_ids)  # the test's own transaction
+        depths = []
+
+        def retrieve_charge(charge_id):
+            depths.append(len(connection.savepoint_ids))
+            return mock.Mock(amount=1000, billing_details=mock.Mock(email=order.email))
+
+        with mock.patch('checkout.webhook_handler.retrieve_charge', side_effect=retrieve_charge), \
+                mock.patch('builtins.print'):
+            job = process_job(WebhookJob.objects.get())
+
+        self.assertEqual(job.status, WebhookJob.DONE, job.result)
+        self.assertEqual(depths, [depth])
+
+
+class EmailOutboxTests(TestCase):
+
+    def test_confirmation_is_sent_from_the_outbox(self):
+        order = create_order(stripe_pid='pi_test')
+        self.assertTrue(queue_email(order))
+        self.assertFalse(queue_email(order))  # queued once, however often the webhook comes
+        self.assertEqual(mail.outbox, [])  # queuing doesn't send anything
+
+        call_command('send_outbox_emails', '--once', stdout=io.StringIO())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['test@example.com'])
+        self.assertIn(order.order_number, mail.outbox[0].subject)
+        self.assertIn('1 High Street', mail.outbox[0].body)
+        self.assertEqual(OutboxEmail.objects.get(order=order).status, OutboxEmail.SENT)
+
+    def test_claimed_emails_are_leased(self):
+        queue_email(create_order(stripe_pid='pi_test_1'))
+        queue_email(create_order(stripe_pid='pi_test_2'))
+
+        self.assertEqual(len(claim_emails(1)), 1)
+        self.assertEqual(len(claim_emails(10)), 1)  # the first one is leased
+        self.assertEqual(claim_emails(10), [])
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + EMAIL_LEASE):
+            self.assertEqual(len(claim_emails(10)), 2)  # the lease ran out, a mailer must have died
+
+    def test_each_outcome_is_saved(self):
+        queue_email(create_order(stripe_pid='pi_test_1'))
+        queue_email(create_order(stripe_pid='pi_test_2'))
+        emails = claim_emails(10)
+
+        with mock.patch('checkout.email_outbox.render_email', side_effect=[mail.EmailMessage(to=['a@example.com']),
+                                                                          ValueError('no template')]):
+            send_emails(emails)
+
+        sent, failed = OutboxEmail.objects.order_by('id')
+        self.assertEqual((sent.status, sent.attempts), (OutboxEmail.SENT, 1))
+        self.assertEqual((failed.status, failed.attempts, failed.error), (OutboxEmail.PENDING, 1, 'no template'))
+        self.assertGreater(failed.run_after, timezone.now())
+
+
+class StripeMetricsTests(TestCase):
+
+    def setUp(self):
+        stripe_client.reset_metrics()
+
+    def test_metrics_are_logged_every_interval(self):
+        with self.settings(STRIPE_METRICS_LOG_INTERVAL=3600), self.assertNoLogs('boutique_ado.stripe'):
+            stripe_client._call('charge.retrieve', lambda: None)
+        self.assertEqual(stripe_client.stripe_metrics()['charge.retrieve']['calls'], 1)
+
+        with self.settings(STRIPE_METRICS_LOG_INTERVAL=0), self.assertLogs('boutique_ado.stripe') as logs:
+            stripe_client._call('charge.retrieve', lambda: None)
+        metrics = json.loads(logs.records[0].getMessage())['stripe']
+        self.assertEqual(metrics['charge.retrieve']['calls'], 2)
+        self.assertEqual(metrics['charge.retrieve']['errors'], 0)
+        self.assertEqual(stripe_client.stripe_metrics(), {})  # counted again from zero
+
+
+class CheckoutPaymentIntentTests(TestCase):
+
+    def setUp(self):
+        product = Product.objects.create(sku='intent-test-1', name='Linen Dress', description='', price='30.00')
+        session = self.client.session
+        session['bag'] = {str(product.id): 1}
+        session['payment_intent'] = {'id': 'pi_saved', 'client_secret': 'pi_saved_secret_test', 'amount': 3300}
+        session.save()
+
+    def _checkout(self, status):
+        """Load the checkout page with Stripe saying the saved intent has this status"""
+        new_intent = mock.Mock(id='pi_new', client_secret='pi_new_secret_test')
+        with mock.patch('checkout.views.retrieve_payment_intent', return_value=mock.Mock(status=status)), \
+                mock.patch('checkout.views.create_payment_intent', return_value=new_intent) as create:
+            response = self.client.get(reverse('checkout'))
+        return response, create
+
+    def test_unpaid_intent_is_used_again(self):
+        response, create = self._checkout('requires_payment_method')
+        self.assertEqual(response.context['client_secret'], 'pi_saved_secret_test')
+        create.assert_not_called()
+
+    def test_paid_intent_is_replaced(self):
+        response, create = self._checkout('succeeded')
+        self.assertEqual(response.context['client_secret'], 'pi_new_secret_test')
+        create.assert_called_once_with(amount=3300, currency=settings.STRIPE_CURRENCY)
+        self.assertEqual(self.client.session['payment_intent']['id'], 'pi_new')
+
+
+class AsyncCheckoutTests(TransactionTestCase):
+    """The async checkout (ASYNC_VIEWS) reads the database in other threads, so the test data is committed"""
+
+    def test_stripe_is_called_in_the_stripe_thread_pool(self):
+        product = Product.objects.create(sku='async-test-1', name='Wool Hat', description='', price='20.00')
+        request = RequestFactory().get(reverse('checkout'))
+        SessionMiddleware(lambda request: None).process_request(request)
+        request.session['bag'] = {str(product.id): 1}
+        request.user = AnonymousUser()
+        request._messages = default_storage(request)
+
+        threads = []
+
+        def create(**params):
+            threads.append(threading.current_thread().name)
+            return mock.Mock(id='pi_async', client_secret='pi_async_secret_test')
+
+        with mock.patch('checkout.views.create_payment_intent', side_effect=create):
+            response = async_to_sync(async_views.checkout)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pi_async_secret_test', response.content.decode())
+        self.assertEqual(request.session['payment_intent']['amount'], 2200)
+        self.assertTrue(threads[0].startswith('stripe'))
+
+
+class OrderTotalsTests(TestCase):
+
+    def _order_with_total(self, total):
+        product = Product.objects.create(sku=f'totals-test-{Product.objects.count()}', name='Mug', description='',
+                                         price=total)
+        order = create_order()
+        OrderLineItem(order=order, product=product, quantity=1).save()  # through the signals
+        order.refresh_from_db()
+        return order
+
+    def test_both_modes_round_like_update_total(self):
+        # delivery rounded half to even, as update_total has always saved it, and the grand total from the exact delivery
+        expected = {'0.05': ('0.00', '0.06'), '0.15': ('0.02', '0.16'), '1.25': ('0.12', '1.38'),
+                    '12.25': ('1.22', '13.48'), '60.00': ('0.00', '60.00')}
+        for mode in ('incremental', 'recalculate'):
+            for total, (delivery, grand_total) in expected.items():
+                with self.subTest(mode=mode, total=total), self.settings(ORDER_TOTALS_MODE=mode):
+                    order = self._order_with_total(Decimal(total))
+                    self.assertEqual((order.delivery_cost, order.grand_total), (Decimal(delivery), Decimal(grand_total)))
+                    self.assertEqual(totals_for(order.order_total), (order.delivery_cost, order.grand_total))
+        self.assertFalse(drifted_orders().exists())
+
+    def test_legacy_order_is_not_drift(self):
+        order = self._order_with_total(Decimal('12.25'))
+        # saved by the old update_total: the delivery unrounded, the DecimalField rounds it half to even
+        order.delivery_cost = order.order_total * 10 / 100
+        order.grand_total = order.order_total + order.delivery_cost
+        order.save()
+        order.refresh_from_db()
+        self.assertEqual((order.delivery_cost, order.grand_total), (Decimal('1.22'), Decimal('13.48')))
+        self.assertFalse(drifted_orders().exists())
+
+    @override_settings(ORDER_TOTALS_MODE='incremental', ORDER_CONFIRMATION_CACHE_TIMEOUT=0)
+    def test_order_number_not_looked_up_without_cached_confirmations(self):
+        order = self._order_with_total(Decimal('10.00'))
+        line_item = OrderLineItem.objects.get(order_id=order.id)
+        line_item.quantity = 2
+        with CaptureQueriesContext(connection) as queries:
+            line_item.save()
+        self.assertFalse([q for q in queries if 'order_number' in q['sql']])
+
+    @override_settings(ORDER_TOTALS_MODE='incremental', ORDER_CONFIRMATION_CACHE_TIMEOUT=60)
+    def test_line_item_change_forgets_the_cached_confirmation(self):
+        order = self._order_with_total(Decimal('10.00'))
+        key = make_template_fragment_key('order_confirmation', [order.order_number])
+        cache.set(key, 'rendered')
+        line_item = OrderLineItem.objects.get(order_id=order.id)
+        line_item.quantity = 2
+        line_item.save()
+        self.assertIsNone(cache.get(key))
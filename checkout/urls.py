@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 from .webhooks import webhook
 
+payment_views = async_views if settings.ASYNC_VIEWS else views  # see async_views.py
+
 urlpatterns = [
-    path('', views.checkout, name='checkout'),
+    path('', payment_views.checkout, name='checkout'),
     path('checkout_success/<order_number>', views.checkout_success, name='checkout_success'),  # it will take the order number as an argument.
-    path('cache_checkout_data/', views.cache_checkout_data, name='cache_checkout_data'),
+    path('cache_checkout_data/', payment_views.cache_checkout_data, name='cache_checkout_data'),
     path('wh/', webhook, name='webhook'),
 
 ]
@@ -2,19 +2,64 @@ from django.shortcuts import render, redirect, reverse, get_object_or_404, HttpR
 from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.conf import settings
+from django.db import IntegrityError, transaction
 
 from .forms import OrderForm
-from .models import Order, OrderLineItem
-from products.models import Product
+from .models import Order
+from .order_builder import create_line_items
+from .stripe_client import create_payment_intent, modify_payment_intent, retrieve_payment_intent
 from bag.contexts import bag_contents
 from profiles.models import UserProfile
 from profiles.forms import UserProfileForm
 
-import stripe
 import json
+import stripe
 
 # Create your views here.
 
+# the statuses of an intent that can still be paid with a card, after those it's paid, being paid or cancelled
+REUSABLE_INTENT_STATUSES = ('requires_payment_method', 'requires_confirmation')
+
+
+def payment_intent_for_total(saved, stripe_total):
+    """
+    The payment intent for the bag's total (in cents), as it's kept in the session.
+
+    The checkout page used to create a new intent every time it was loaded. The intent we made is
+    kept in the session (saved) with its amount, and used again as long as Stripe says it can
+    still be paid: if the amount changed we update the amount. If it was paid already (the customer paid
+    but never got to checkout_success), is being paid or was cancelled we make a new one.
+    Retrieving it is a quick GET, creating one is the slow call.
+    checkout_success forgets it once the order is placed.
+    Only Stripe is called here, so the async checkout (async_views.py) runs it in the Stripe thread pool.
+    """
+    if saved:
+        try:
+            intent = retrieve_payment_intent(saved['id'])
+            if intent.status in REUSABLE_INTENT_STATUSES:
+                if saved['amount'] != stripe_total:
+                    modify_payment_intent(saved['id'], amount=stripe_total)
+                return {**saved, 'amount': stripe_total}
+        except stripe.error.InvalidRequestError:
+            pass  # it's gone or it can't be changed anymore, make a new one
+
+    intent = create_payment_intent(
+        amount=stripe_total,
+        currency=settings.STRIPE_CURRENCY,
+    )
+    return {
+        'id': intent.id,
+        'client_secret': intent.client_secret,
+        'amount': stripe_total,
+    }
+
+
+def save_payment_intent(request, saved, intent):
+    """Keep the intent in the session, the session is only saved again when it changed"""
+    if intent != saved:
+        request.session['payment_intent'] = intent
+
+
 @require_POST
 def cache_checkout_data(request):
     """before we call the confirm card payment method in the stripe javascript, we make a post request
@@ -23,11 +68,10 @@ def cache_checkout_data(request):
     """
     try:
         pid = request.POST.get('client_secret').split('_secret')[0]
-        stripe.api_key = settings.STRIPE_SECRET_KEY
-        stripe.PaymentIntent.modify(pid, metadata={
+        modify_payment_intent(pid, metadata={
             'bag': json.dumps(request.session.get('bag', {})),
             'save_info': request.POST.get('save_info'),
-            'username': request.user,
+            'username': str(request.user),
         })
         return HttpResponse(status=200)
     
@@ -38,9 +82,6 @@ def cache_checkout_data(request):
 
 def checkout(request):
 
-    stripe_public_key = settings.STRIPE_PUBLIC_KEY
-    stripe_secret_key = settings.STRIPE_SECRET_KEY
-
     if request.method == 'POST':
         bag = request.session.get('bag', {})
         # I'm doing this manually in order to skip the save infobox which doesn't have a field on the order model.
@@ -64,37 +105,25 @@ def checkout(request):
             pid = request.POST.get('client_secret').split('_secret')[0]
             order.stripe_pid = pid
             order.original_bag = json.dumps(bag)
-            order.save()
-
-            # And then we need to iterate through the bag items to create each line item.
-            for item_id, item_data in bag.items():
-                try:
-                    product = Product.objects.get(id=item_id)
-                    if isinstance(item_data, int):
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=item_data,
-                        )
-                        order_line_item.save()
-                    else:
-                        for size, quantity in item_data['items_by_size'].items():
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=quantity,
-                                product_size=size,
-                            )
-                            order_line_item.save()
-                # Finally this should theoretically never happen but just in case a product isn't found we'll add an error message.
-                # Delete the empty order and return the user to the shopping bag page.
-                except Product.DoesNotExist:
-                    messages.error(request, (
-                        "One of the products in your bag wasn't found in our database. "
-                        "Please call us for assistance!")
-                    )
-                    order.delete()
-                    return redirect(reverse('view_bag'))
+
+            # The order and all its line items are saved together, if anything goes wrong nothing is saved.
+            missing = []
+            try:
+                with transaction.atomic():
+                    order.save()
+                    _, missing = create_line_items(order, bag)
+            # There's already an order for this payment (the form was sent twice, or the webhook
+            # worker got there first), stripe_pid is unique so we show that order instead.
+            except IntegrityError:
+                order = get_object_or_404(Order, stripe_pid=pid)
+
+            # A product was deleted between loading the checkout page and paying for it.
+            # The order is made without it, the customer should hear about the difference.
+            if missing:
+                messages.warning(request, (
+                    "One of the products in your bag wasn't available anymore and isn't in your order. "
+                    "Please contact us for a refund of it.")
+                )
 
             request.session['save_info'] = 'save-info' in request.POST
             print(order.order_number)
@@ -123,51 +152,54 @@ def checkout(request):
         current_bag = bag_contents(request)
         total = current_bag['grand_total']
         stripe_total = round(total * 100)
-        stripe.api_key = stripe_secret_key
-        intent = stripe.PaymentIntent.create(
-            amount=stripe_total,
-            currency=settings.STRIPE_CURRENCY,
-        )
-        # print(intent)
-        
-        # prepopulate form with user profile
-        if request.user.is_authenticated:
-            try:
-                profile = UserProfile.objects.get(user=request.user)
-                order_form = OrderForm(initial={
-                    'full_name': profile.user.get_full_name(),
-                    'email': profile.user.email,
-                    'phone_number': profile.default_phone_number,
-                    'country': profile.default_country,
-                    'postcode': profile.default_postcode,
-                    'town_or_city': profile.default_town_or_city,
-                    'street_address1': profile.default_street_address1,
-                    'street_address2': profile.default_street_address2,
-                    'county': profile.default_county,
-
-                })
-            except UserProfile.DoesNotExist:
-                order_form = OrderForm()  # empty form
-        else:
+        saved = request.session.get('payment_intent')
+        intent = payment_intent_for_total(saved, stripe_total)
+        save_payment_intent(request, saved, intent)
+        return checkout_page(request, intent['client_secret'])
+
+
+def checkout_page(request, client_secret):
+    """The checkout form, for the payment intent with this client secret"""
+    stripe_public_key = settings.STRIPE_PUBLIC_KEY
+
+    # prepopulate form with user profile
+    if request.user.is_authenticated:
+        try:
+            profile = UserProfile.objects.get(user=request.user)
+            order_form = OrderForm(initial={
+                'full_name': profile.user.get_full_name(),
+                'email': profile.user.email,
+                'phone_number': profile.default_phone_number,
+                'country': profile.default_country,
+                'postcode': profile.default_postcode,
+                'town_or_city': profile.default_town_or_city,
+                'street_address1': profile.default_street_address1,
+                'street_address2': profile.default_street_address2,
+                'county': profile.default_county,
+
+            })
+        except UserProfile.DoesNotExist:
             order_form = OrderForm()  # empty form
+    else:
+        order_form = OrderForm()  # empty form
 
 
-        
+    
 
-        if not stripe_public_key:
-            messages.warning(request, 'Stripe public key is missing. \
-                            Is it set in your environment?')
+    if not stripe_public_key:
+        messages.warning(request, 'Stripe public key is missing. \
+                        Is it set in your environment?')
 
 
-        template = 'checkout/checkout.html'
-        context = {
-            'order_form': order_form,
-            'stripe_public_key': stripe_public_key,
-            'client_secret': intent.client_secret,
+    template = 'checkout/checkout.html'
+    context = {
+        'order_form': order_form,
+        'stripe_public_key': stripe_public_key,
+        'client_secret': client_secret,
 
-        }
+    }
 
-        return render(request, template, context)
+    return render(request, template, context)
     
 
 def checkout_success(request, order_number):
@@ -208,9 +240,14 @@ def checkout_success(request, order_number):
     # delete bag from session
     if 'bag' in request.session:
         del request.session['bag']
+    # and the payment intent, it's paid so the next checkout needs a new one
+    request.session.pop('payment_intent', None)
     
     template = 'checkout/checkout_success.html'
     context = {
         'order': order,
+        # not evaluated when the order details are in the cache, otherwise one query for all the line items
+        'line_items': order.lineitems.select_related('product'),
+        'confirmation_cache_timeout': settings.ORDER_CONFIRMATION_CACHE_TIMEOUT,
     }
     return render(request, template, context)
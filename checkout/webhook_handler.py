@@ -1,15 +1,37 @@
 from django.http import HttpResponse
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.conf import settings
+from django.db import transaction
 
-from .models import Order, OrderLineItem
-from products.models import Product
+from .models import Order, OutboxEmail
+from .email_outbox import queue_email
+from .order_builder import create_line_items
+from .stripe_client import retrieve_charge
 from profiles.models import UserProfile
 
+from decimal import Decimal
 import json
-import time
-import stripe
+
+ORDER_LOOKUP_ATTEMPTS = 5  # how many times (a second apart) we look for the order before creating it
+
+
+class OrderNotReady(Exception):
+    """The order for a payment isn't in the database yet, the webhook should be tried again later"""
+
+
+def _order_mismatches(order, expected):
+    """The names of the fields of order that are different from the expected values"""
+    mismatches = []
+    for field, value in expected.items():
+        actual = getattr(order, field)
+        if field == 'grand_total':
+            if actual != Decimal(str(value)):
+                mismatches.append(field)
+        elif field == 'original_bag':
+            if actual != value:
+                mismatches.append(field)
+        elif str(actual or '').lower() != str(value or '').lower():  # None and '' are both empty
+            mismatches.append(field)
+    return mismatches
+
 
 class StripeWH_Handler:
     """Handle Stripe webhooks
@@ -24,21 +46,12 @@ just in case we need to access any attributes of the request coming from stripe.
 
 
     def _send_confirmation_email(self, order):  # private method
-        """Send user confirmation email"""
-        cust_email = order.email  # email address
-        """Then we can use the render_to_string method to render both the files we just created two strings.
-            With the first parameter being the file we want to render.
-            And the second being at context just like we would pass to a template.
-            This is how we'll be able to render the various context variables in the confirmation email."""
-        subject = render_to_string(
-            'checkout/confirmation_emails/confirmation_email_subject.txt',
-            {'order': order})
-        body = render_to_string(
-            'checkout/confirmation_emails/confirmation_email_body.txt',
-            {'order': order, 'contact_email': settings.DEFAULT_FROM_EMAIL})
-        
-        # send email
-        send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [cust_email])
+        """Queue the user confirmation email
+
+        It's added to the outbox in the same transaction as the order and sent by
+        manage.py send_outbox_emails, so a slow mail server doesn't slow down the webhook.
+        """
+        queue_email(order, OutboxEmail.ORDER_CONFIRMATION)
 
 
     
@@ -49,8 +62,39 @@ just in case we need to access any attributes of the request coming from stripe.
             content=f'Unhandled webhook received: {event["type"]}',
             status=200)
     
-    def handle_payment_intent_succeeded(self, event):
-        """Handle payment_intent.succeeded from Stripe"""
+    def _find_order(self, pid):
+        # stripe_pid is unique (and indexed) so this is a single row lookup, however many orders there are.
+        # The exclude matches the condition of the unique index so every database knows it can use it.
+        return Order.objects.filter(stripe_pid=pid).exclude(stripe_pid='').first()
+
+    def lookup_payment_intent_succeeded(self, event, attempt=ORDER_LOOKUP_ATTEMPTS):
+        """
+        The order of the payment (None when there isn't one yet) and its Charge, from Stripe.
+
+        The worker (webhook_queue.process_job) gets it before it opens the job's transaction,
+        so no transaction (or lock on the order) is kept open while Stripe answers.
+        attempt is how many times the worker has tried this event (starting at 1), if the order
+        isn't in the database yet and there are attempts left OrderNotReady is raised, before Stripe is asked.
+        """
+        intent = event.data.object
+        order = self._find_order(intent.id)
+        if order is None and attempt < ORDER_LOOKUP_ATTEMPTS:
+            # The checkout view might still be saving the order. Instead of sleeping here
+            # the worker (manage.py process_webhooks) tries again a second later, a few times,
+            # before we create the order ourselves.
+            raise OrderNotReady(intent.id)
+
+        # Get the Charge object
+        return order, retrieve_charge(intent.latest_charge)
+
+    def handle_payment_intent_succeeded(self, event, attempt=ORDER_LOOKUP_ATTEMPTS, looked_up=None):
+        """Handle payment_intent.succeeded from Stripe
+
+        looked_up is what lookup_payment_intent_succeeded returned, without it the lookup is done
+        here (and OrderNotReady can be raised, see there).
+        """
+        order, stripe_charge = looked_up or self.lookup_payment_intent_succeeded(event, attempt)
+
         # payment intent from stripe, should have metadata
         intent = event.data.object
         print(intent)
@@ -60,10 +104,8 @@ just in case we need to access any attributes of the request coming from stripe.
         bag = intent.metadata.bag
         save_info = intent.metadata.save_info
 
-        # Get the Charge object
-        stripe_charge = stripe.Charge.retrieve(
-            intent.latest_charge
-        )
+        if order is None:
+            order = self._find_order(pid)  # the checkout view could have saved it since the lookup
 
         billing_details = stripe_charge.billing_details # updated
         shipping_details = intent.shipping
@@ -91,35 +133,33 @@ just in case we need to access any attributes of the request coming from stripe.
                 profile.save()
 
 
+        # in normal situation, the order goes through and is in database when we receive this webhook
+        order_exists = order is not None
+
+        if order_exists:
+            # The order was found on the payment id alone, now check that it's really the order that was paid for.
+            # This is the same comparison the lookup used to do in the database (case-insensitive like __iexact).
+            mismatches = _order_mismatches(order, {
+                'full_name': shipping_details.name,
+                'email': billing_details.email,
+                'phone_number': shipping_details.phone,
+                'country': shipping_details.address.country,
+                'postcode': shipping_details.address.postal_code,
+                'town_or_city': shipping_details.address.city,
+                'street_address1': shipping_details.address.line1,
+                'street_address2': shipping_details.address.line2,
+                'county': shipping_details.address.state,
+                'grand_total': grand_total,
+                'original_bag': bag,
+            })
+            if mismatches:
+                # it's still the order for this payment so we don't create a second one, but someone should look at it
+                self._send_confirmation_email(order)
+                return HttpResponse(
+                    content=(f'Webhook received: {event["type"]} | WARNING: Order {order.order_number} '
+                             f'does not match the payment on: {", ".join(mismatches)}'),
+                    status=200)
 
-        # in normal situation, the order goes through and is in database when we receive this webhook let's assume it does not exist
-        order_exists = False
-
-        attempt = 1
-        while attempt <= 5:
-            # Then we'll try to get the order using all the information from the payment intent. And I'm using the iexact lookup field to make it an exact match but case-insensitive.
-            try:
-                order = Order.objects.get(
-                    full_name__iexact=shipping_details.name,
-                    email__iexact=billing_details.email,
-                    phone_number__iexact=shipping_details.phone,
-                    country__iexact=shipping_details.address.country,
-                    postcode__iexact=shipping_details.address.postal_code,
-                    town_or_city__iexact=shipping_details.address.city,
-                    street_address1__iexact=shipping_details.address.line1,
-                    street_address2__iexact=shipping_details.address.line2,
-                    county__iexact=shipping_details.address.state,
-                    grand_total=grand_total,
-                    original_bag=bag,
-                    stripe_pid=pid,  # so it is unique, not double order, in case order has same bag
-                )
-
-                order_exists = True
-                break
-            except Order.DoesNotExist:
-                attempt += 1
-                time.sleep(1)     # sleep one second   
-        
         if order_exists:
             self._send_confirmation_email(order)
             return HttpResponse(
@@ -129,42 +169,25 @@ just in case we need to access any attributes of the request coming from stripe.
                 order = None
                 # from views.py with some changes
                 try:
-                    order = Order.objects.create(
-                        full_name=shipping_details.name,
-                        user_profile=profile,  # add profile to order
-                        email=billing_details.email,
-                        phone_number=shipping_details.phone,
-                        country=shipping_details.address.country,
-                        postcode=shipping_details.address.postal_code,
-                        town_or_city=shipping_details.address.city,
-                        street_address1=shipping_details.address.line1,
-                        street_address2=shipping_details.address.line2,
-                        county=shipping_details.address.state,
-                        original_bag=bag,
-                        stripe_pid=pid,
-
-                    )
-                    for item_id, item_data in json.loads(bag).items():
-                        product = Product.objects.get(id=item_id)
-                        if isinstance(item_data, int):
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=item_data,
-                            )
-                            order_line_item.save()
-                        else:
-                            for size, quantity in item_data['items_by_size'].items():
-                                order_line_item = OrderLineItem(
-                                    order=order,
-                                    product=product,
-                                    quantity=quantity,
-                                    product_size=size,
-                                )
-                                order_line_item.save()
+                    # the order and its line items are saved together, or not at all
+                    with transaction.atomic():
+                        order = Order.objects.create(
+                            full_name=shipping_details.name,
+                            user_profile=profile,  # add profile to order
+                            email=billing_details.email,
+                            phone_number=shipping_details.phone,
+                            country=shipping_details.address.country,
+                            postcode=shipping_details.address.postal_code,
+                            town_or_city=shipping_details.address.city,
+                            street_address1=shipping_details.address.line1,
+                            street_address2=shipping_details.address.line2,
+                            county=shipping_details.address.state,
+                            original_bag=bag,
+                            stripe_pid=pid,
+
+                        )
+                        create_line_items(order, json.loads(bag))
                 except Exception as e:
-                    if order:
-                        order.delete()
                     return HttpResponse(content=f'Webhook received: {event["type"]} | ERROR: {e}',
                                         status=500 )
         
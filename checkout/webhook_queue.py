@@ -0,0 +1,120 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+import stripe
+
+from .models import WebhookJob
+from .webhook_handler import StripeWH_Handler, OrderNotReady
+
+"""
+A small job queue in the database for Stripe webhooks.
+
+The webhook view used to find or create the order itself, sleeping up to five seconds
+while it waited for the checkout view to save the order. That kept a gunicorn worker busy
+the whole time. Now the view only queues the event (one insert) and answers Stripe,
+and the worker process (manage.py process_webhooks, the worker line in the Procfile)
+handles the queued events.
+"""
+
+QUEUED_EVENTS = ('payment_intent.succeeded', 'payment_intent.payment_failed')
+RETRY_DELAY = timedelta(seconds=1)  # between the lookups for an order that isn't saved yet
+LEASE = timedelta(minutes=5)  # how long a claimed job is left to the worker that claimed it
+MAX_ATTEMPTS = 10  # a job is given up after this many attempts (the order lookups count too)
+
+
+def enqueue(event, payload):
+    """Save a verified event for the worker. Returns False if we already had it."""
+    try:
+        with transaction.atomic():
+            WebhookJob.objects.create(
+                event_id=event['id'],
+                event_type=event['type'],
+                payload=payload.decode() if isinstance(payload, bytes) else payload,
+            )
+    except IntegrityError:
+        return False  # Stripe sent it again, it's queued or done already
+    return True
+
+
+def claim_jobs(batch_size):
+    """
+    Lease the jobs that are due, oldest first: their run_after is moved LEASE ahead, so no other
+    worker takes them while this one handles them. That happens in a short transaction of its own,
+    the jobs are then handled one by one in their own transactions (process_job), so no lock is held
+    while the handler waits for Stripe. A worker that dies halfway leaves its jobs to be picked up
+    again when the lease runs out.
+    On Postgres the rows are locked and skipped by other workers while they're leased, so more workers
+    can run at the same time. SQLite doesn't have row locks but it's only used with one local worker.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = WebhookJob.objects.filter(
+            status=WebhookJob.PENDING, run_after__lte=now).order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        jobs = list(jobs[:batch_size])
+        WebhookJob.objects.filter(pk__in=[job.pk for job in jobs]).update(run_after=now + LEASE)
+    return jobs
+
+
+def process_job(job):
+    """Run the webhook handler for one job and store the outcome on it"""
+    # only builds the event object from the json, the API calls go through stripe_client.py
+    event = stripe.Event.construct_from(json.loads(job.payload), settings.STRIPE_SECRET_KEY)
+    handler = StripeWH_Handler(None)
+    event_map = {
+        'payment_intent.succeeded': handler.handle_payment_intent_succeeded,
+        'payment_intent.payment_failed': handler.handle_payment_intent_payment_failed,
+    }
+
+    job.attempts += 1
+    now = timezone.now()
+    looked_up = None
+    try:
+        if job.event_type == 'payment_intent.succeeded':
+            # Stripe is asked before the transaction below, no transaction is open while it answers
+            looked_up = handler.lookup_payment_intent_succeeded(event, attempt=job.attempts)
+    except OrderNotReady:
+        job.run_after = now + RETRY_DELAY
+        job.result = 'Order not in the database yet'
+        job.save()
+        return job
+    except Exception as e:
+        _failed(job, now, str(e))
+        job.save()
+        return job
+
+    # one transaction per job, what the handler did and the outcome on the job are saved together
+    with transaction.atomic():
+        try:
+            # a savepoint, so a database error in the handler doesn't break the job's transaction
+            with transaction.atomic():
+                if job.event_type == 'payment_intent.succeeded':
+                    response = event_map[job.event_type](event, attempt=job.attempts, looked_up=looked_up)
+                else:
+                    response = event_map.get(job.event_type, handler.handle_event)(event)
+        except Exception as e:
+            _failed(job, now, str(e))
+        else:
+            job.result = response.content.decode()
+            if response.status_code == 200:
+                job.status = WebhookJob.DONE
+                job.processed = now
+            else:
+                _failed(job, now, job.result)
+        job.save()
+    return job
+
+
+def _failed(job, now, error):
+    """Try again later with a growing delay, or give up after MAX_ATTEMPTS attempts"""
+    job.result = error
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = WebhookJob.FAILED
+        job.processed = now
+    else:
+        job.run_after = now + RETRY_DELAY * 2 ** job.attempts
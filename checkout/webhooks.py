@@ -4,6 +4,7 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 
 from checkout.webhook_handler import StripeWH_Handler
+from checkout.webhook_queue import enqueue, QUEUED_EVENTS
 
 import stripe
 """We'll need our settings file to get the webhook and the stripe API secrets.
@@ -18,9 +19,9 @@ And CSRF exempt since stripe won't send a CSRF token like we'd normally need."""
 def webhook(request):
     """Listen for webhooks from Stripe"""
     # Setup
-    # we'll need to set up the stripe API key and the webhook secret which will be used to verify that the webhook actually came from stripe. 
+    # we'll need the webhook secret which will be used to verify that the webhook actually came from stripe.
+    # (no API key here, verifying doesn't call Stripe and the API calls go through stripe_client.py)
     wh_secret = settings.STRIPE_WH_SECRET 
-    stripe.api_key = settings.STRIPE_SECRET_KEY
 
     # get the webhook data and verify its signature
     payload = request.body
@@ -47,25 +48,20 @@ def webhook(request):
 
     #set up webhook handler
     """First I'll just create an
-    instance of it passing in the request. Then I'll create a dictionary called event map
-    and the dictionaries keys will be the names of the webhooks coming from stripe. While its values will be the actual methods inside the handler."""
+    instance of it passing in the request.
+    The payment events are only queued here, so Stripe gets its answer straight away and this
+    gunicorn worker is free again. manage.py process_webhooks finds or creates the order."""
     handler = StripeWH_Handler(request)
 
-    # map webhook events to relevant handler functions
-    event_map = {
-        'payment_intent.succeeded': handler.handle_payment_intent_succeeded,
-        'payment_intent.payment_failed': handler.handle_payment_intent_payment_failed,
-    }
-
     # get the webhook type from stripe
     """Now let's get the type of the event from stripe which will be stored in a key called type."""
     event_type = event['type']
-    """And then we'll look up the key in the dictionary.
-    And assign its value to a variable called event handler"""
-    event_handler = event_map.get(event_type, handler.handle_event)
-
-    # call the evnet handler with the event
-    response = event_handler(event)
-    return response
 
+    if event_type in QUEUED_EVENTS:
+        queued = enqueue(event, payload)
+        return HttpResponse(
+            content=f'Webhook received: {event_type} | {"Queued" if queued else "Already queued"}',
+            status=200)
 
+    # any other event is answered right away, there's nothing to do for it
+    return handler.handle_event(event)
@@ -1,8 +1,91 @@
+import gzip
+import re
+
 from django.conf import settings
-from storages.backends.s3boto3 import S3Boto3Storage
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from storages.backends.s3boto3 import S3Boto3Storage, S3ManifestStaticStorage
+
+try:
+    import brotli  # optional, only used for the pre-compressed .br files
+except ImportError:
+    brotli = None
+
+"""
+Storages for the static and media files.
+
+With STATIC_MANIFEST set (settings.py) collectstatic gives every static file a name with
+a hash of its content in it, like css/base.3a9c1f2e4b5d.css, and writes staticfiles.json so
+{% static %} knows the hashed names. A changed file gets a new name, so browsers can keep
+the old ones forever without asking again (Cache-Control: immutable).
+"""
+
+# a year, the longest browsers keep anything
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SHORT = 'public, max-age=300'
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.')  # css/base.3a9c1f2e4b5d.css
+# text files, images are compressed already
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.xml', '.html', '.ico')
+
 
 class StaticStorage(S3Boto3Storage):
-    location = settings.STATICFILES_LOCATION
+    location = getattr(settings, 'STATICFILES_LOCATION', 'static')
+
 
 class MediaStorage(S3Boto3Storage):
-    location = settings.MEDIAFILES_LOCATION
\ No newline at end of file
+    """
+    Uploaded product images. They don't have hashed names but an upload never replaces
+    a file with the same name (file_overwrite), so they can be cached for a long time too.
+    """
+    location = getattr(settings, 'MEDIAFILES_LOCATION', 'media')
+    file_overwrite = False
+    object_parameters = {'CacheControl': 'public, max-age=31536000'}
+
+
+class ManifestS3StaticStorage(S3ManifestStaticStorage):
+    """
+    Hashed static files on S3. They are uploaded gzipped (with Content-Encoding: gzip, every
+    browser supports it) because S3 can't pick between a .gz and .br file for each visitor.
+    """
+    location = getattr(settings, 'STATICFILES_LOCATION', 'static')
+    object_parameters = {'CacheControl': IMMUTABLE}
+    gzip = True
+    gzip_content_types = (
+        'text/css', 'text/javascript', 'application/javascript', 'application/x-javascript',
+        'image/svg+xml', 'application/json',
+    )
+
+    def get_object_parameters(self, name):
+        """collectstatic uploads the files with their own names too, those can change so they aren't immutable"""
+        params = super().get_object_parameters(name)
+        if not HASHED_NAME.search(name):
+            params['CacheControl'] = SHORT
+        return params
+
+
+class CompressedManifestStaticStorage(ManifestStaticFilesStorage):
+    """
+    Hashed static files in STATIC_ROOT, served by WhiteNoise (settings.py) or a web server in front
+    of gunicorn (like nginx with gzip_static and brotli_static on). Next to every text file there's
+    a .gz and, when the brotli package is installed, a .br version, so they aren't compressed on every request.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if not dry_run and hashed_name and not isinstance(processed, Exception) \
+                    and hashed_name.endswith(COMPRESSIBLE):
+                self._compress(hashed_name)
+            yield name, hashed_name, processed
+
+    def _compress(self, name):
+        with self.open(name) as file:
+            content = file.read()
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for extension, compressed in variants:
+            if len(compressed) >= len(content):
+                continue  # tiny files can get bigger
+            if self.exists(name + extension):
+                self.delete(name + extension)
+            self._save(name + extension, ContentFile(compressed))
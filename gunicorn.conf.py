@@ -0,0 +1,16 @@
+import os
+
+"""
+gunicorn reads this file when it starts (web in the Procfile).
+
+By default the site runs as before: the WSGI app with gunicorn's sync workers, one request
+at a time per worker. With ASYNC_VIEWS set it runs the ASGI app (boutique_ado/asgi.py) with
+uvicorn workers instead, and the catalogue, bag and checkout views are the async ones.
+The number of workers comes from WEB_CONCURRENCY like before (Heroku sets it).
+"""
+
+if 'ASYNC_VIEWS' in os.environ:
+    wsgi_app = 'boutique_ado.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'boutique_ado.wsgi:application'
@@ -11,6 +11,8 @@ class ProductAdmin(admin.ModelAdmin):
         'image',
     )
 
+    list_select_related = ('category',)  # the category column would be a query per row otherwise
+
     ordering = ('sku',)  # Since it's possible to sort on multiple columns note that this does have to be a tuple even though it's only one field.
 
 class CategoryAdmin(admin.ModelAdmin):
@@ -0,0 +1,20 @@
+from . import views
+from boutique_ado.threads import in_own_thread
+
+"""
+Async versions of the catalogue views, used when ASYNC_VIEWS is set (settings.py) and the site
+runs under uvicorn workers (gunicorn.conf.py).
+
+Django 3.2 has no async ORM, and the cache, the session and the template context processors
+(the bag in the navbar) all use it or other blocking calls, so the sync views do the work in
+a thread of the pool (boutique_ado/threads.py). Requests run side by side while they wait for
+the database, the rendering itself still takes its turn with the other threads (the GIL).
+"""
+
+
+async def all_products(request):
+    return await in_own_thread(views.all_products)(request)
+
+
+async def product_detail(request, product_id):
+    return await in_own_thread(views.product_detail)(request, product_id)
@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+
+"""
+What the benchmark commands (benchmark_search, benchmark_storefront, benchmark_order_lookup) share.
+
+They seed a synthetic catalogue or order history, time it and throw it all away again:
+everything is written inside rolled_back(), so nothing is kept in the database.
+"""
+
+# product names and descriptions are made of these, the searches look for them
+WORDS = (
+    'cotton', 'linen', 'denim', 'jeans', 'shirt', 'dress', 'jacket', 'coat', 'scarf',
+    'wool', 'leather', 'boots', 'sandals', 'summer', 'winter', 'classic', 'slim',
+    'relaxed', 'vintage', 'striped', 'floral', 'black', 'white', 'navy', 'red',
+    'mug', 'candle', 'pillow', 'blanket', 'lamp', 'soft', 'handmade', 'organic',
+)
+
+
+class Rollback(Exception):
+    """Raised to throw away the seeded data at the end of a benchmark"""
+
+
+@contextmanager
+def rolled_back():
+    """A transaction that is always rolled back, also when the block ends normally"""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
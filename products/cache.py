@@ -0,0 +1,105 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models.query import EmptyQuerySet
+
+from .models import Product, Category
+
+"""
+Caching for the catalogue, on the cache backend chosen with CACHE_URL in settings.py.
+
+Every cache key for the catalogue includes the catalogue version, a number that the
+signals in signals.py increase whenever a product or category changes.
+So nothing has to be deleted one by one, the old entries are just never read again
+and expire by themselves.
+
+The get_ functions are read-through: they return what's in the cache and only go to
+the database (and fill the cache) when it isn't there.
+That needs a cache all the processes share (CACHE_SHARED in settings.py). The version is bumped
+by whichever process changed the catalogue, a web worker or manage.py import_catalogue, and
+with a cache per process the others would go on serving what they cached before.
+So with the default locmem cache they always go to the database.
+"""
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+CATALOGUE_TIMEOUT = 60 * 60
+PRODUCT_COUNT_TIMEOUT = 60 * 15
+
+_MISSING = object()  # so a cached None (a product that doesn't exist) isn't a cache miss
+
+
+def catalogue_version():
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(CATALOGUE_VERSION_KEY, version, None)
+    return version
+
+
+def bump_catalogue_version():
+    """Called when a product or category is saved or deleted"""
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:  # the key isn't in the cache (yet)
+        cache.set(CATALOGUE_VERSION_KEY, 2, None)
+
+
+def catalogue_key(*parts):
+    """A cache key in the current catalogue version, like catalogue:3:product:12"""
+    return ':'.join(['catalogue', str(catalogue_version()), *map(str, parts)])
+
+
+def read_through(key, load, timeout=CATALOGUE_TIMEOUT):
+    """Get key from the cache, or call load() and cache what it returns"""
+    if not settings.CACHE_SHARED:
+        return load()
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = load()
+        cache.set(key, value, timeout)
+    return value
+
+
+def get_product(product_id):
+    """A product with its category, or None if there's no product with that id"""
+    return read_through(
+        catalogue_key('product', product_id),
+        lambda: Product.objects.select_related('category').filter(pk=product_id).first())
+
+
+def get_product_by_sku(sku):
+    """
+    The few fields of a product the SKU lookup (views.product_by_sku) answers with,
+    or None if no product has that (normalized) SKU. Unknown SKUs are cached too,
+    so a scanner sending the same wrong code again and again doesn't reach the database.
+    """
+    return read_through(
+        catalogue_key('sku', sku),
+        lambda: Product.objects.filter(sku=sku).values(
+            'id', 'sku', 'name', 'price', 'category__name').first())
+
+
+def get_categories():
+    """All the categories, there are only a handful"""
+    return read_through(catalogue_key('categories'), lambda: list(Category.objects.all()))
+
+
+def cached_product_count(products):
+    """
+    The number of products in a filtered queryset,
+    counted once per catalogue version instead of on every page view.
+    The SQL of the query itself is the cache key so each search/category filter gets its own count.
+    A query that can't match anything (a search without any words) has no SQL, that's 0.
+    """
+    if isinstance(products, EmptyQuerySet):
+        return 0
+    try:
+        sql = str(products.order_by().query)
+    except EmptyResultSet:  # like a filter on an empty list, category__name__in=[]
+        return 0
+    return read_through(
+        catalogue_key('count', hashlib.sha1(sql.encode()).hexdigest()),
+        products.count,
+        PRODUCT_COUNT_TIMEOUT)
@@ -0,0 +1,87 @@
+import csv
+import json
+from decimal import Decimal
+
+"""
+Reading and writing catalogue files for manage.py import_catalogue and export_catalogue.
+
+Both formats are read and written one product at a time, so a file with hundreds of
+thousands of products never has to fit in memory (loaddata parses the whole fixture first).
+
+A product is a dict with the Product fields, and the category by name:
+{"sku": "pp5001340155", "name": "...", "category": "jeans", "price": "53.99", ...}
+The fixtures (products/fixtures/*.json) can be imported too, those have the fields under
+"fields" and the category by its pk in categories.json.
+"""
+
+PRODUCT_FIELDS = ('sku', 'name', 'description', 'category', 'has_sizes', 'price', 'rating', 'image_url', 'image')
+CHUNK_SIZE = 1 << 16
+
+
+def read_json(file):
+    """The objects in the JSON array in file, one by one"""
+    decoder = json.JSONDecoder(parse_float=Decimal)  # no float rounding of the prices
+    buffer = ''
+    position = 0
+    expect = '['
+    end_of_file = False
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if end_of_file:
+                raise ValueError('The JSON array ends before its ]')
+            buffer, position, end_of_file = _read_more(file, buffer, position)
+            continue
+
+        if expect == '[':
+            if buffer[position] != '[':
+                raise ValueError('A catalogue in JSON has to be an array of products')
+            position += 1
+            expect = 'first'
+        elif expect in ('first', ',') and buffer[position] == ']':
+            return
+        elif expect == ',':
+            if buffer[position] != ',':
+                raise ValueError(f'Expected , or ] in the JSON at {buffer[position:position + 20]!r}')
+            position += 1
+            expect = 'value'
+        else:
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                # the object goes on in the next chunk
+                buffer, position, end_of_file = _read_more(file, buffer, position)
+                continue
+            expect = ','
+            yield value
+
+
+def _read_more(file, buffer, position):
+    """Drop what's been parsed from the buffer and add the next chunk of the file"""
+    chunk = file.read(CHUNK_SIZE)
+    return buffer[position:] + chunk, 0, not chunk
+
+
+def read_csv(file):
+    """The rows of a CSV file with a header line of field names, as dicts"""
+    yield from csv.DictReader(file)
+
+
+def write_json(products, file):
+    """Write the product dicts as a JSON array, one product per line"""
+    file.write('[')
+    separator = '\n'
+    for product in products:
+        file.write(separator)
+        file.write(json.dumps(product, default=str))  # default=str for the Decimals
+        separator = ',\n'
+    file.write('\n]\n')
+
+
+def write_csv(products, file):
+    writer = csv.DictWriter(file, PRODUCT_FIELDS)
+    writer.writeheader()
+    writer.writerows(products)
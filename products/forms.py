@@ -1,6 +1,8 @@
 from django import forms
 from .widgets import CustomClearableFileInput
-from .models import Product, Category
+from .models import Product
+from .cache import get_categories
+from .images import generate_derivatives
 
 class ProductForm(forms.ModelForm):
 
@@ -12,7 +14,7 @@ class ProductForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)  # override init method
-        categories = Category.objects.all()
+        categories = get_categories()
         """And create a list of tuples of the friendly names associated with their category ids.
         This special syntax is called the list comprehension.
         And is just a shorthand way of creating a for loop that adds items to a list.
@@ -25,5 +27,18 @@ class ProductForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             field.widget.attrs['class'] = 'border-black rounded-0'
 
-        
-
+    def save(self, commit=True):
+        """Make the smaller copies of a newly uploaded image (see images.py) before the product is saved"""
+        product = super().save(commit=False)
+        if 'image' in self.changed_data:
+            if product.image:
+                # store the original now (normally saving the product does this) so the copies can be made from it
+                if not product.image._committed:
+                    product.image.save(product.image.name, product.image.file, save=False)
+                product.image_derivatives = generate_derivatives(product.image.storage, product.image.name)
+            else:
+                product.image_derivatives = {}  # the image was cleared
+        if commit:
+            product.save()
+            self.save_m2m()
+        return product
@@ -0,0 +1,71 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from PIL import Image, ImageOps
+
+"""
+Smaller copies (derivatives) of the product images.
+
+The product cards used to load the full size original even though they are only a few
+hundred pixels wide. For every image we make a WebP and a JPEG copy at each width in
+PRODUCT_IMAGE_WIDTHS (settings.py), saved next to the original on the same storage
+(media/ locally, S3 on Heroku), like media/shirt.jpg -> media/shirt.300w.webp.
+The browser picks the size it needs from the srcset in the templates, and WebP if it can.
+
+The names are saved on the product (Product.image_derivatives), so the templates don't
+need to look at the storage. Made when an image is uploaded with ProductForm, and for the
+images that are already there by manage.py generate_image_derivatives.
+"""
+
+FORMATS = {
+    # extension: (Pillow format, save options)
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def derivative_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{width}w.{extension}'
+
+
+def _encode(image, image_format, options):
+    buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')  # no transparency in jpeg
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def generate_derivatives(storage, name):
+    """
+    Make the derivatives of the image called name on storage, replacing old ones.
+    Returns what's stored in Product.image_derivatives:
+    {'source': name, 'images': [{'width': 300, 'webp': 'shirt.300w.webp', 'jpg': 'shirt.300w.jpg'}, ...]}
+    """
+    with storage.open(name, 'rb') as file:
+        original = Image.open(file)
+        original = ImageOps.exif_transpose(original)  # photos from phones can be stored sideways
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    # no copies bigger than the original, but at least one so small originals get a webp too
+    widths = [width for width in settings.PRODUCT_IMAGE_WIDTHS if width < original.width] \
+        or [original.width]
+
+    images = []
+    for width in widths:
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.LANCZOS)
+        entry = {'width': width}
+        for extension, (image_format, options) in FORMATS.items():
+            derivative = derivative_name(name, width, extension)
+            if storage.exists(derivative):
+                storage.delete(derivative)  # otherwise storage.save would pick another name
+            entry[extension] = storage.save(derivative, _encode(resized, image_format, options))
+        images.append(entry)
+    return {'source': name, 'images': images}
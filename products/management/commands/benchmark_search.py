@@ -0,0 +1,71 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from products.benchmarking import WORDS, rolled_back
+from products.models import Product, Category
+from products.search import search_products, rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic catalogue and compare the old icontains search '
+            'with the full text search. Nothing is kept in the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='search term to time, can be given more than once')
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or ['jeans', 'striped cotton shirt', 'handmade candle', 'zebra']
+        with rolled_back():  # the seeded products (and their search rows)
+            self._seed(options['products'])
+            for query in queries:
+                old = self._time(lambda: self._icontains(query), options['repeat'])
+                new = self._time(lambda: self._search(query), options['repeat'])
+                self.stdout.write(
+                    f'{query!r:26} icontains {old * 1000:8.1f} ms | '
+                    f'full text {new * 1000:8.1f} ms')
+
+    def _seed(self, count):
+        rng = random.Random(42)  # same catalogue every run
+        category = Category.objects.create(name='benchmark', friendly_name='Benchmark')
+        started = time.perf_counter()
+        Product.objects.bulk_create((
+            Product(
+                category=category,
+                sku=f'BENCH{i:07d}',
+                name=' '.join(rng.choices(WORDS, k=3)).title(),
+                description=self._description(rng),
+                price=rng.randint(100, 50000) / 100,
+            ) for i in range(count)
+        ), batch_size=5000)
+        rebuild_index()  # bulk_create doesn't send post_save
+        self.stdout.write(f'Seeded {count} products in {time.perf_counter() - started:.1f}s')
+
+    def _description(self, rng):
+        """A few catalogue words mixed into a large vocabulary of filler words,
+        so common terms don't match most of the catalogue"""
+        words = rng.choices(WORDS, k=4) + [f'w{rng.randrange(20000)}' for _ in range(36)]
+        rng.shuffle(words)
+        return ' '.join(words)
+
+    def _icontains(self, query):
+        queries = Q(name__icontains=query) | Q(description__icontains=query)
+        return list(Product.objects.filter(queries).values_list('id', flat=True))
+
+    def _search(self, query):
+        products = search_products(Product.objects.all(), query).order_by('-search_rank')
+        return list(products.values_list('id', flat=True))
+
+    def _time(self, func, repeat):
+        """Best of repeat runs, in seconds"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
@@ -0,0 +1,349 @@
+import hashlib
+import hmac
+import io
+import json
+import math
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+from contextlib import redirect_stdout
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bag.contexts import bag_contents
+from checkout import stripe_client
+from checkout.models import Order, OrderLineItem, WebhookJob, totals_for
+from checkout.webhook_queue import process_job
+from products.benchmarking import WORDS, rolled_back
+from products.models import Category, Product
+from products.search import rebuild_index
+
+SORTS = (None, 'price_asc', 'price_desc', 'rating_asc', 'rating_desc', 'name_asc', 'name_desc',
+         'category_asc', 'category_desc')
+FILTERS = ('none', 'category', 'search', 'category+search')
+SEARCH = 'striped cotton'
+EMAIL = 'benchmark@example.com'
+ADDRESS = {
+    'full_name': 'Bench Mark', 'email': EMAIL, 'phone_number': '0123456789', 'country': 'GB',
+    'postcode': 'AB1 2CD', 'town_or_city': 'Leeds', 'street_address1': '1 High Street',
+    'street_address2': '', 'county': 'Yorkshire',
+}
+BENCHMARK_SETTINGS = {
+    # a cache of its own, so it starts empty every run and the real cache isn't touched
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'benchmark_storefront'}},
+    'CACHE_SHARED': True,  # one process, the catalogue is cached like it is with redis
+    'STRIPE_SECRET_KEY': 'sk_test_benchmark',
+    'STRIPE_WH_SECRET': 'whsec_benchmark',
+    'STRIPE_MAX_NETWORK_RETRIES': 0,
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+}
+
+
+class FakeStripe(BaseHTTPRequestHandler):
+    """
+    Just enough of the Stripe API for the checkout and the webhook handler, so the benchmark
+    runs offline and measures our code, not the network. A charge id carries its amount: ch_bench_5399.
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive, like api.stripe.com
+    intents = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _answer(self, body):
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        data = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        if self.path == '/v1/payment_intents':
+            FakeStripe.intents += 1
+            intent_id = f'pi_bench_intent_{FakeStripe.intents}'
+        else:
+            intent_id = self.path.rsplit('/', 1)[1]
+        self._answer({'id': intent_id, 'object': 'payment_intent', 'client_secret': f'{intent_id}_secret_bench',
+                      'amount': int(data.get('amount', ['0'])[0]), 'metadata': {}})
+
+    def do_GET(self):
+        object_id = self.path.rsplit('/', 1)[1]
+        if self.path.startswith('/v1/payment_intents/'):
+            self._answer({'id': object_id, 'object': 'payment_intent', 'status': 'requires_payment_method',
+                          'client_secret': f'{object_id}_secret_bench', 'metadata': {}})
+            return
+        self._answer({'id': object_id, 'object': 'charge', 'amount': int(object_id.rsplit('_', 1)[1]),
+                      'billing_details': {'email': EMAIL}})
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic catalogue, bag and order history (nothing is kept in the database), '
+            'time the storefront hot paths with a fake Stripe and compare the latency percentiles and '
+            'query counts with the baseline in benchmarks/. Works on SQLite and, with DATABASE_URL, Postgres.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='size of the catalogue, like 1000 or 100000')
+        parser.add_argument('--orders', type=int, default=200, help='orders in the order history')
+        parser.add_argument('--repeat', type=int, default=20, help='runs of every case')
+        parser.add_argument('--baseline', help='defaults to benchmarks/baseline-<database>-<products>.json')
+        parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='how much slower than the baseline (0.5 is 50%%) a median can get')
+
+    def handle(self, *args, **options):
+        baseline_path = Path(options['baseline'] or
+                             Path(settings.BASE_DIR) / 'benchmarks' /
+                             f'baseline-{connection.vendor}-{options["products"]}.json')
+        self.repeat = options['repeat']
+        self.rng = random.Random(42)  # the same data every run
+        self.results = {}
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStripe)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with override_settings(STRIPE_API_BASE=f'http://127.0.0.1:{server.server_port}', **BENCHMARK_SETTINGS):
+                stripe_client.reset_clients()
+                # everything seeded (and the orders made by the benchmark) is rolled back.
+                # The checkout and webhook code print (order numbers, payment intents), not in the report
+                with rolled_back(), redirect_stdout(io.StringIO()):
+                    self._seed(options['products'], options['orders'])
+                    self._run_cases()
+        finally:
+            server.shutdown()
+            stripe_client.reset_clients()
+
+        self._report(baseline_path, options)
+
+    # seeding
+
+    def _seed(self, product_count, order_count):
+        started = time.perf_counter()
+        rng = self.rng
+        run = uuid.uuid4().hex[:6]  # in the names, so nothing clashes with what's in the database
+        Category.objects.bulk_create(
+            Category(name=f'benchmark_{run}_{i}', friendly_name=f'Benchmark {i}') for i in range(10))
+        # fetched again, only Postgres returns the ids from bulk_create
+        self.categories = list(Category.objects.filter(name__startswith=f'benchmark_{run}_').order_by('id'))
+        Product.objects.bulk_create((
+            Product(
+                category=rng.choice(self.categories),
+                sku=f'bench-{run}-{i:07d}',
+                name=' '.join(rng.choices(WORDS, k=3)).title(),
+                description=' '.join(rng.choices(WORDS, k=rng.randint(10, 40))),
+                has_sizes=i % 3 == 0,
+                price=Decimal(rng.randint(100, 20000)) / 100,
+                rating=Decimal(rng.randint(0, 500)) / 100,
+            ) for i in range(product_count)
+        ), batch_size=2000)
+        rebuild_index()  # bulk_create skips the signals that fill the SQLite search table
+        products = list(Product.objects.filter(sku__startswith=f'bench-{run}-').only('id', 'price', 'has_sizes'))
+
+        self.bag = {}
+        for product in rng.sample(products, min(10, len(products))):
+            self.bag[str(product.id)] = {'items_by_size': {'m': 1, 'l': 2}} if product.has_sizes else 2
+
+        self.user = User.objects.create_user(f'benchmark-{run}', EMAIL, 'benchmark')
+        self.orders = self._seed_orders(products, order_count)
+        self.stdout.write(f'Seeded {product_count} products and {order_count} orders '
+                          f'in {time.perf_counter() - started:.1f}s ({connection.vendor})')
+
+    def _seed_orders(self, products, count):
+        """Orders with 1-4 line items and the right totals, as if they had been placed at checkout"""
+        rng = self.rng
+        prices = {product.id: product.price for product in products}
+        orders = []
+        line_items = []
+        for _ in range(count):
+            bag = {str(product.id): rng.randint(1, 3) for product in rng.sample(products, rng.randint(1, 4))}
+            items = [(int(product_id), quantity, prices[int(product_id)] * quantity)
+                     for product_id, quantity in bag.items()]
+            order_total = sum(total for _, _, total in items)
+            delivery, grand_total = totals_for(order_total)
+            orders.append(Order(
+                user_profile=self.user.userprofile, stripe_pid=f'pi_bench_order_{uuid.uuid4().hex}',
+                original_bag=json.dumps(bag), order_total=order_total, delivery_cost=delivery,
+                grand_total=grand_total, **ADDRESS))
+            line_items.append(items)
+        Order.objects.bulk_create(orders, batch_size=1000)
+        orders = list(Order.objects.filter(user_profile=self.user.userprofile).order_by('id'))
+        OrderLineItem.objects.bulk_create((
+            OrderLineItem(order=order, product_id=product_id, quantity=quantity, lineitem_total=total)
+            for order, items in zip(orders, line_items) for product_id, quantity, total in items
+        ), batch_size=2000)
+        return orders
+
+    # the cases
+
+    def _run_cases(self):
+        host = settings.ALLOWED_HOSTS[0]
+        visitor = Client(HTTP_HOST=host)
+        category = self.categories[0].name
+        for sort in SORTS:
+            for filter_name in FILTERS:
+                params = {}
+                if sort:
+                    params['sort'], params['direction'] = sort.split('_')
+                if 'category' in filter_name:
+                    params['category'] = category
+                if 'search' in filter_name:
+                    params['q'] = SEARCH
+                self._measure(f'all_products sort={sort or "default"} filter={filter_name}',
+                              lambda i, params=params: visitor.get(reverse('products'), params))
+
+        request = RequestFactory().get('/')
+        request.session = {'bag': self.bag}
+        self._measure('bag_contents', lambda i: bag_contents(self._fresh(request)))
+
+        shopper = Client(HTTP_HOST=host)
+        session = shopper.session
+        session['bag'] = self.bag
+        session.save()
+        self._measure('checkout GET', lambda i: shopper.get(reverse('checkout')))
+        self._measure('checkout POST', lambda i: shopper.post(reverse('checkout'), {
+            **ADDRESS, 'client_secret': f'pi_bench_checkout_{uuid.uuid4().hex}_secret_bench'}))
+
+        orders = self.rng.sample(self.orders, min(self.repeat, len(self.orders)))
+        stripe_hook = Client(HTTP_HOST=host)
+        self._measure('webhook view', lambda i: self._post_webhook(stripe_hook, orders[i % len(orders)]))
+        self._measure('webhook handling', lambda i: self._handle_webhook(orders[i % len(orders)]))
+
+        customer = Client(HTTP_HOST=host)
+        customer.force_login(self.user)
+        self._measure('order_history profile page', lambda i: customer.get(reverse('profile')))
+        next_page = self._next_page_url(customer)
+        if next_page:
+            self._measure('order_history next page', lambda i: customer.get(next_page))
+        self._measure('order_history order', lambda i: customer.get(
+            reverse('order_history', args=[orders[i % len(orders)].order_number])))
+
+    def _fresh(self, request):
+        """bag_contents remembers its result on the request, every run needs a new one"""
+        request.__dict__.pop('_bag_contents', None)
+        return request
+
+    def _next_page_url(self, customer):
+        """Where the profile page's javascript loads the second page of orders from"""
+        html = customer.get(reverse('profile')).content.decode()
+        match = re.search(r'id="order-history-more"[^>]*data-url="([^"]+)"', html)
+        return match.group(1) if match else None
+
+    def _event(self, order):
+        """A payment_intent.succeeded event for an order that's in the database, like Stripe sends it"""
+        return {
+            'id': f'evt_bench_{uuid.uuid4().hex}',
+            'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {
+                'id': order.stripe_pid,
+                'object': 'payment_intent',
+                'latest_charge': f'ch_bench_{int(order.grand_total * 100)}',
+                'metadata': {'bag': order.original_bag, 'save_info': '', 'username': self.user.username},
+                'shipping': {
+                    'name': order.full_name, 'phone': order.phone_number,
+                    'address': {'country': str(order.country), 'postal_code': order.postcode,
+                                'city': order.town_or_city, 'line1': order.street_address1,
+                                'line2': order.street_address2, 'state': order.county},
+                },
+            }},
+        }
+
+    def _post_webhook(self, client, order):
+        payload = json.dumps(self._event(order))
+        timestamp = int(time.time())
+        signature = hmac.new(settings.STRIPE_WH_SECRET.encode(), f'{timestamp}.{payload}'.encode(),
+                             hashlib.sha256).hexdigest()
+        return client.post(reverse('webhook'), payload, content_type='application/json',
+                           HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    def _handle_webhook(self, order):
+        """What the worker (process_webhooks) does with a queued event"""
+        event = self._event(order)
+        job = WebhookJob.objects.create(event_id=event['id'], event_type=event['type'], payload=json.dumps(event))
+        job = process_job(job)
+        if job.status != WebhookJob.DONE or 'SUCCESS' not in job.result:
+            raise CommandError(f'webhook handling failed: {job.result}')
+
+    def _measure(self, name, run):
+        seconds = []
+        queries = []
+        for i in range(self.repeat):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = run(i)
+                seconds.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            status = getattr(response, 'status_code', 200)
+            if status >= 400:
+                raise CommandError(f'{name}: status {status}')
+        seconds.sort()
+        self.results[name] = {
+            'p50': round(statistics.median(seconds) * 1000, 2),
+            'p95': round(_percentile(seconds, 95) * 1000, 2),
+            'max': round(seconds[-1] * 1000, 2),
+            'queries': int(statistics.median(queries)),
+            'max_queries': max(queries),  # the first (cold cache) run makes more, an N+1 in one run shows here
+        }
+
+    # the report
+
+    def _report(self, baseline_path, options):
+        baseline = {}
+        if baseline_path.exists() and not options['save_baseline']:
+            baseline = json.loads(baseline_path.read_text())['results']
+
+        self.stdout.write(f'{"case":<54} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8} {"queries":>7} {"max":>4}  baseline')
+        regressions = []
+        for name, result in self.results.items():
+            line = (f'{name:<54} {result["p50"]:8.2f} {result["p95"]:8.2f} {result["max"]:8.2f} '
+                    f'{result["queries"]:7d} {result["max_queries"]:4d}')
+            base = baseline.get(name)
+            if base:
+                line += f'  {base["p50"]:8.2f} ms {base["queries"]:3d} queries, max {base.get("max_queries", "-")}'
+                # 1 ms of slack, the fast cases vary more than 50% from run to run
+                if result['p50'] > base['p50'] * (1 + options['tolerance']) + 1:
+                    regressions.append(f'{name}: median {base["p50"]} ms -> {result["p50"]} ms')
+                if result['queries'] > base['queries']:
+                    regressions.append(f'{name}: {base["queries"]} -> {result["queries"]} queries')
+                if 'max_queries' in base and result['max_queries'] > base['max_queries']:
+                    regressions.append(f'{name}: at most {base["max_queries"]} -> {result["max_queries"]} queries')
+            self.stdout.write(line)
+
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps({
+                'database': connection.vendor,
+                'products': options['products'],
+                'orders': options['orders'],
+                'repeat': options['repeat'],
+                'results': self.results,
+            }, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Saved the baseline in {baseline_path}'))
+        elif not baseline:
+            self.stdout.write(f'No baseline in {baseline_path} yet, make one with --save-baseline')
+        elif regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f'{len(regressions)} regressions compared to {baseline_path}')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'No regressions compared to {baseline_path}'))
+
+
+def _percentile(values, percent):
+    """Nearest rank percentile of sorted values"""
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.db.models.functions import Lower
+
+from products.models import Product, Category
+from products.pagination import page_queryset
+
+# the sort options on the products page and the field they sort on, like in all_products
+SORTS = {
+    None: None,
+    'price': 'price',
+    'rating': 'rating',
+    'name': 'lower_name',
+    'category': 'category__name',
+}
+
+
+class Command(BaseCommand):
+    help = ('Print the query plan (EXPLAIN) of the products page for every sort '
+            'and category filter, for the first page and for a deep page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', action='append', dest='categories',
+                            help='category name to filter on, defaults to the first category')
+        parser.add_argument('--per-page', type=int, default=24)
+
+    def handle(self, *args, **options):
+        categories = options['categories']
+        if not categories:
+            categories = list(Category.objects.values_list('name', flat=True)[:1])
+
+        for sort, sort_field in SORTS.items():
+            for direction in ('asc', 'desc') if sort else ('asc',):
+                for category_filter in (None, categories):
+                    products = Product.objects.all()
+                    if sort_field == 'lower_name':
+                        products = products.annotate(lower_name=Lower('name'))
+                    if category_filter:
+                        products = products.filter(category__name__in=category_filter)
+
+                    for page in ('first', 'deep'):
+                        position = self._deep_position(products, sort_field) if page == 'deep' else {}
+                        query = page_queryset(products, sort_field, direction == 'desc',
+                                              position, options['per_page'])
+                        filtered = f' category={",".join(category_filter)}' if category_filter else ''
+                        self.stdout.write(self.style.MIGRATE_HEADING(
+                            f'sort={sort} direction={direction}{filtered} page={page}'))
+                        self.stdout.write(query.explain())
+                        self.stdout.write('')
+
+    def _deep_position(self, products, sort_field):
+        """A cursor in the middle of the results, like a visitor deep into the pages would have"""
+        products = products.order_by('id')
+        fields = ['id']
+        if sort_field is not None:
+            products = products.annotate(sort_key=F(sort_field))
+            fields.append('sort_key')
+        middle = products.count() // 2
+        row = products.values(*fields)[middle:middle + 1].first() or {'id': 0}
+        return {'d': 'n', 'i': row['id'], 'v': row.get('sort_key')}
@@ -0,0 +1,46 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalogue_io import PRODUCT_FIELDS, write_csv, write_json
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Write every product to a JSON or CSV file that import_catalogue can read, '
+            'streamed from the database so it works for any size of catalogue.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='- for stdout')
+        parser.add_argument('--format', choices=['json', 'csv'],
+                            help='defaults to the extension of the file')
+
+    def handle(self, *args, **options):
+        path = options['file']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in ('json', 'csv'):
+            raise CommandError('use --format, the extension isn\'t json or csv')
+
+        # values_list() and iterator() so no Product objects are made and the rows aren't all kept in memory
+        fields = [name if name != 'category' else 'category__name' for name in PRODUCT_FIELDS]
+        products = Product.objects.order_by('pk').values_list(*fields).iterator(chunk_size=2000)
+
+        started = time.perf_counter()
+        self.count = 0
+        write = write_json if file_format == 'json' else write_csv
+        if path == '-':
+            write(self._counted(products), sys.stdout)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                write(self._counted(products), file)
+
+        seconds = time.perf_counter() - started
+        self.stderr.write(f'Exported {self.count} products in {seconds:.1f}s '
+                          f'({self.count / max(seconds, 1e-9):.0f} rows/s)')
+
+    def _counted(self, products):
+        """The rows as dicts with the category name under category, counting them on the way"""
+        for product in products:
+            self.count += 1
+            yield dict(zip(PRODUCT_FIELDS, product))
@@ -0,0 +1,68 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from products.cache import bump_catalogue_version
+from products.images import generate_derivatives
+from products.models import Product
+
+
+def _init_worker():
+    """Worker processes that aren't forked (macOS, Windows) have to set up Django themselves"""
+    django.setup()
+
+
+def _generate(product_id, name):
+    """Runs in a worker process, only touches the storage, the database is updated by the main process"""
+    try:
+        return product_id, generate_derivatives(default_storage, name), None
+    except Exception as e:
+        return product_id, None, f'{type(e).__name__}: {e}'
+
+
+class Command(BaseCommand):
+    help = ('Make the smaller WebP/JPEG copies of the product images (see products/images.py) '
+            'for products that don\'t have them yet, in parallel.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of processes, defaults to the number of CPUs')
+        parser.add_argument('--all', action='store_true',
+                            help='make them again for every product, not only the missing ones')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True) \
+            .only('id', 'image', 'image_derivatives')
+        todo = [(product.id, product.image.name) for product in products
+                if options['all'] or not product._derivatives()]
+        if not todo:
+            self.stdout.write('All product images have their copies')
+            return
+
+        started = time.perf_counter()
+        done = []
+        # the workers get a fresh database connection if they need one, not a copy of ours
+        connections.close_all()
+        with ProcessPoolExecutor(options['workers'], initializer=_init_worker) as pool:
+            futures = [pool.submit(_generate, product_id, name) for product_id, name in todo]
+            for future in as_completed(futures):
+                product_id, derivatives, error = future.result()
+                if error:
+                    self.stderr.write(f'Product {product_id}: {error}')
+                else:
+                    done.append(Product(id=product_id, image_derivatives=derivatives, updated_at=timezone.now()))
+
+        # updated_at is part of the product card cache key, so the cards are rendered again with the srcset
+        Product.objects.bulk_update(done, ['image_derivatives', 'updated_at'], batch_size=500)
+        bump_catalogue_version()  # bulk_update doesn't send signals
+
+        seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Made the copies of {len(done)} of {len(todo)} images in {seconds:.1f}s '
+            f'with {options["workers"]} processes'))
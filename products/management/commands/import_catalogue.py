@@ -0,0 +1,182 @@
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from products.cache import bump_catalogue_version
+from products.catalogue_io import read_csv, read_json
+from products.models import Category, Product, normalize_sku
+from products.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Import products from JSON or CSV files (see products/catalogue_io.py), a batch at a time. '
+            'A product with a sku that\'s already in the database is updated, the others are added. '
+            'Fixtures work too: manage.py import_catalogue products/fixtures/categories.json '
+            'products/fixtures/products.json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+        parser.add_argument('--format', choices=['json', 'csv'],
+                            help='defaults to the extension of each file')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # every category is looked up here instead of in the database for each product
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.fixture_categories = {}  # pk in a categories fixture: id in the database
+        self.counts = {'created': 0, 'updated': 0, 'skipped': 0}
+        self.batches = 0
+
+        started = time.perf_counter()
+        for path in options['files']:
+            file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+            if file_format not in ('json', 'csv'):
+                raise CommandError(f'{path}: use --format, the extension isn\'t json or csv')
+            with open(path, encoding='utf-8', newline='') as file:
+                rows = read_json(file) if file_format == 'json' else read_csv(file)
+                self._import(path, rows, options['batch_size'], started)
+
+        # bulk_create and bulk_update don't send the signals that keep these up to date
+        rebuild_index()
+        bump_catalogue_version()
+
+        seconds = time.perf_counter() - started
+        total = self.counts['created'] + self.counts['updated']
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {self.counts["created"]} and updated {self.counts["updated"]} products, '
+            f'skipped {self.counts["skipped"]} rows, in {seconds:.1f}s ({total / max(seconds, 1e-9):.0f} rows/s)'))
+
+    def _import(self, path, rows, batch_size, started):
+        batch = {}
+        for number, row in enumerate(rows, 1):
+            if row.get('model') == 'products.category':
+                self._import_category(row)
+                continue
+            try:
+                fields = self._product_fields(row.get('fields', row))
+            except (ValueError, InvalidOperation) as e:
+                self.stderr.write(f'{path} product {number}: {e}')
+                self.counts['skipped'] += 1
+                continue
+            except ValidationError as e:
+                self.stderr.write(f'{path} product {number}: {" ".join(e.messages)}')
+                self.counts['skipped'] += 1
+                continue
+            # a sku twice in one batch: the rows are merged, the later one wins for the fields in both
+            batch.setdefault(fields['sku'], {}).update(fields)
+            if len(batch) >= batch_size:
+                self._save(batch)
+                batch = {}
+                self.batches += 1
+                if self.batches % 10 == 0:
+                    total = self.counts['created'] + self.counts['updated']
+                    self.stdout.write(f'{total} products, {total / (time.perf_counter() - started):.0f} rows/s')
+        if batch:
+            self._save(batch)
+
+    def _import_category(self, row):
+        fields = row['fields']
+        category, created = Category.objects.get_or_create(
+            name=fields['name'], defaults={'friendly_name': fields.get('friendly_name')})
+        if not created and fields.get('friendly_name') and category.friendly_name != fields['friendly_name']:
+            category.friendly_name = fields['friendly_name']
+            category.save()
+        self.categories[category.name] = category.id
+        self.fixture_categories[row.get('pk')] = category.id
+
+    def _category_id(self, value):
+        """A category pk (fixtures) or name. A name we don't know yet is added as a new category."""
+        if value in (None, ''):
+            return None
+        if isinstance(value, int):
+            if value not in self.fixture_categories and value not in self.categories.values():
+                raise ValueError(f'no category with pk {value}')
+            return self.fixture_categories.get(value, value)
+        if value not in self.categories:
+            category = Category.objects.create(name=value, friendly_name=value.replace('_', ' ').title())
+            self.categories[value] = category.id
+        return self.categories[value]
+
+    def _product_fields(self, row):
+        """
+        The model fields of a row. Only the fields that are in the row, so a file
+        without ratings, say, doesn't clear the ratings of the products it updates.
+        """
+        sku = normalize_sku(row.get('sku'))
+        if not sku:
+            raise ValueError('no sku')
+        fields = {'sku': sku}
+        for name in ('name', 'description', 'image_url', 'image'):
+            if name in row:
+                fields[name] = row[name] or ('' if name in ('name', 'description') else None)
+        if 'category' in row:
+            fields['category'] = row['category']  # looked up in _save, only for the products that are saved
+        # clean() checks they fit the columns (6 digits, 2 decimals), bulk_create would fail the whole batch
+        if 'price' in row:
+            fields['price'] = Product._meta.get_field('price').clean(Decimal(str(row['price'])), None)
+        if 'rating' in row:
+            fields['rating'] = Product._meta.get_field('rating').clean(Decimal(str(row['rating'])), None) \
+                if row['rating'] not in (None, '') else None
+        if 'has_sizes' in row:
+            value = row['has_sizes']
+            fields['has_sizes'] = value if isinstance(value, bool) or value is None \
+                else str(value).strip().lower() in ('1', 'true', 'yes')
+        return fields
+
+    @transaction.atomic
+    def _save(self, batch):
+        """
+        Add or update one batch of products, in one transaction.
+        Django 3.2 has no bulk_create(update_conflicts=True) (that's 4.1), so we look up which
+        skus exist in one query and split the batch into a bulk_create and bulk_updates.
+        """
+        existing = dict(Product.objects.filter(sku__in=list(batch)).values_list('sku', 'id'))
+        now = timezone.now()  # a new updated_at, so the cached product cards are rendered again
+
+        new_products = []
+        updates = {}  # the fields being updated: the products
+        for sku, fields in batch.items():
+            if sku not in existing and ('name' not in fields or 'price' not in fields):
+                self.stderr.write(f'{sku}: a new product needs a name and a price')
+                self.counts['skipped'] += 1
+                continue
+            if 'category' in fields:
+                fields = dict(fields)
+                try:
+                    fields['category_id'] = self._category_id(fields.pop('category'))
+                except ValueError as e:
+                    self.stderr.write(f'{sku}: {e}')
+                    self.counts['skipped'] += 1
+                    continue
+            if sku in existing:
+                product = Product(id=existing[sku], updated_at=now, **fields)
+                updates.setdefault(tuple(sorted(fields.keys() - {'sku'})), []).append(product)
+            else:
+                new_products.append(Product(updated_at=now, **fields))
+
+        Product.objects.bulk_create(new_products, batch_size=1000)
+        for fields, products in updates.items():
+            self._update(products, [*fields, 'updated_at'])
+
+        self.counts['created'] += len(new_products)
+        self.counts['updated'] += sum(len(products) for products in updates.values())
+
+    def _update(self, products, field_names):
+        """
+        One UPDATE ... WHERE id = ? run for all the products with executemany.
+        bulk_update builds a CASE WHEN with every product for every field, which takes
+        a few milliseconds per product in Python alone, too slow for a big catalogue.
+        """
+        fields = [Product._meta.get_field(name) for name in field_names]
+        columns = ', '.join(f'{connection.ops.quote_name(field.column)} = %s' for field in fields)
+        sql = f'UPDATE {connection.ops.quote_name(Product._meta.db_table)} SET {columns} WHERE id = %s'
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields]
+                + [product.id]
+                for product in products
+            ])
@@ -0,0 +1,98 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Load test the catalogue and bag pages on running servers, to compare the sync '
+            'workers (gunicorn) with the uvicorn workers and async views (ASYNC_VIEWS), e.g.\n'
+            'gunicorn -b :8000 & ASYNC_VIEWS=1 gunicorn -b :8001 &\n'
+            'manage.py loadtest_views --url http://127.0.0.1:8000 --url http://127.0.0.1:8001')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True,
+                            help='base url of a server, give it once per server to compare')
+        parser.add_argument('--requests', type=int, default=500, help='requests per page and server')
+        parser.add_argument('--concurrency', type=int, default=20, help='clients sending at the same time')
+        parser.add_argument('--checkout', action='store_true',
+                            help='also load the checkout page and post to cache_checkout_data, which wait on Stripe. '
+                                 'Only with the servers\' STRIPE_API_BASE pointing at stripe-mock or another fake Stripe')
+
+    def handle(self, *args, **options):
+        product = Product.objects.order_by('pk').first()
+        if product is None:
+            raise CommandError('Needs at least one product, load the fixtures first')
+        pages = [
+            ('products', 'GET', reverse('products')),
+            ('product detail', 'GET', reverse('product_detail', args=[product.id])),
+            ('add to bag', 'POST', reverse('add_to_bag', args=[product.id])),
+            ('bag', 'GET', reverse('view_bag')),
+        ]
+        if options['checkout']:
+            pages.append(('checkout', 'GET', reverse('checkout')))
+            pages.append(('checkout data', 'POST', reverse('cache_checkout_data')))
+        self.add_to_bag = reverse('add_to_bag', args=[product.id])
+        # a page with a form, so the server sets the csrftoken cookie
+        self.form_page = reverse('product_detail', args=[product.id])
+
+        results = {}
+        for base_url in options['url']:
+            self.stdout.write(f'{base_url}')
+            for name, method, path in pages:
+                result = self._run(base_url.rstrip('/'), method, path, options)
+                results[base_url, name] = result
+                self.stdout.write(
+                    f'  {name:<15} {result["rate"]:8.1f} req/s  '
+                    f'median {result["median"]:7.1f} ms  p95 {result["p95"]:7.1f} ms  '
+                    f'errors {result["errors"]}')
+
+        if len(options['url']) > 1:
+            first, *others = options['url']
+            for other in others:
+                self.stdout.write(f'{other} compared to {first}:')
+                for name, _, _ in pages:
+                    ratio = results[other, name]['rate'] / results[first, name]['rate']
+                    self.stdout.write(f'  {name:<15} {ratio:.2f}x the requests per second')
+
+    def _run(self, base_url, method, path, options):
+        local = threading.local()  # every client thread has its own session (cookies, bag) and connection
+
+        def send(_):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.get(base_url + self.form_page)
+                if path == reverse('checkout'):  # the checkout page needs something in the bag
+                    local.session.post(base_url + self.add_to_bag, data={'quantity': 1, 'redirect_url': '/'},
+                                       headers={'X-CSRFToken': local.session.cookies.get('csrftoken', '')},
+                                       allow_redirects=False)
+            started = time.perf_counter()
+            if method == 'POST':
+                response = local.session.post(
+                    base_url + path,
+                    data={'quantity': 1, 'redirect_url': reverse('view_bag'),
+                          'client_secret': 'pi_loadtest_secret_loadtest', 'save_info': ''},
+                    headers={'X-CSRFToken': local.session.cookies.get('csrftoken', '')},
+                    allow_redirects=False)
+            else:
+                response = local.session.get(base_url + path)
+            return response.status_code < 400, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(send, range(options['requests'])))
+        wall = time.perf_counter() - started
+
+        seconds = sorted(seconds for _, seconds in timings)
+        return {
+            'rate': len(seconds) / wall,
+            'median': statistics.median(seconds) * 1000,
+            'p95': seconds[int(len(seconds) * 0.95) - 1] * 1000,
+            'errors': sum(not ok for ok, _ in timings),
+        }
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+"""
+The search index depends on the database.
+Postgres gets a GIN index on the same to_tsvector expression that
+products/search.py queries with, SQLite gets an FTS5 table filled with the
+current products. Any other database just keeps using icontains.
+"""
+
+INDEX_NAME = 'products_search_gin'
+FTS_TABLE = 'products_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+        index = GinIndex(SearchVector('name', 'description', config='english'), name=INDEX_NAME)
+        schema_editor.add_index(Product, index)
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5"
+            f"(name, description, tokenize='porter unicode61')")
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f'SELECT id, name, description FROM {Product._meta.db_table}')
+
+
+def drop_search_index(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+        index = GinIndex(SearchVector('name', 'description', config='english'), name=INDEX_NAME)
+        schema_editor.remove_index(Product, index)
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_auto_20250526_1212'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:12
+
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.text
+
+
+"""
+Ratings are sorted with nulls last in both directions. Postgres can use an ascending index
+backwards for that, but for rating DESC NULLS LAST it needs its own index.
+SQLite doesn't allow NULLS LAST in an index at all so these are Postgres only.
+"""
+
+
+def rating_desc_indexes():
+    F = django.db.models.expressions.F
+    return [
+        models.Index(F('rating').desc(nulls_last=True), F('id').desc(), name='product_rating_desc_idx'),
+        models.Index(F('category'), F('rating').desc(nulls_last=True), F('id').desc(),
+                     name='product_cat_rating_desc_idx'),
+    ]
+
+
+def create_rating_desc_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        Product = apps.get_model('products', 'Product')
+        for index in rating_desc_indexes():
+            schema_editor.add_index(Product, index)
+
+
+def drop_rating_desc_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        Product = apps.get_model('products', 'Product')
+        for index in rating_desc_indexes():
+            schema_editor.remove_index(Product, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(db_index=True, max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Lower('name'), django.db.models.expressions.F('id'), name='product_lower_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'rating', 'id'], name='product_cat_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.expressions.F('category'), django.db.models.functions.text.Lower('name'), django.db.models.expressions.F('id'), name='product_cat_lower_name_idx'),
+        ),
+        migrations.RunPython(create_rating_desc_indexes, drop_rating_desc_indexes),
+    ]
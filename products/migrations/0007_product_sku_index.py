@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, db_index=True, max_length=254, null=True),
+        ),
+    ]
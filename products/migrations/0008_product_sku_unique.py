@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:48
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_skus(apps, schema_editor):
+    """
+    Store the SKUs like normalize_sku does (stripped, lower case, None instead of ''),
+    then give the products sharing a SKU their id at the end (see _free_sku), all but the
+    oldest one, so the unique index can be created and nothing is deleted.
+    """
+    Product = apps.get_model('products', 'Product')
+    changed = []
+    for product in Product.objects.exclude(sku__isnull=True).only('id', 'sku').iterator():
+        sku = product.sku.strip().lower() or None
+        if sku != product.sku:
+            product.sku = sku
+            changed.append(product)
+    Product.objects.bulk_update(changed, ['sku'], batch_size=500)
+
+    duplicates = (Product.objects.exclude(sku__isnull=True).values('sku')
+                  .annotate(products=Count('id')).filter(products__gt=1).values_list('sku', flat=True))
+    for sku in list(duplicates):
+        for product in Product.objects.filter(sku=sku).order_by('id')[1:]:
+            product.sku = _free_sku(Product, sku, product.id)
+            product.save(update_fields=['sku'])
+
+
+def _free_sku(Product, sku, product_id):
+    """
+    sku with -duplicate-<id> at the end, the SKU cut short to leave room for it in the column.
+    That can be some other product's SKU already, then a number is added too,
+    and if those are all taken the product is left without a SKU.
+    """
+    max_length = Product._meta.get_field('sku').max_length
+    for attempt in range(1, 11):
+        suffix = f'-duplicate-{product_id}' + (f'-{attempt}' if attempt > 1 else '')
+        candidate = sku[:max_length - len(suffix)] + suffix
+        if not Product.objects.filter(sku=candidate).exists():
+            return candidate
+    return None
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_sku_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_skus, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=254, null=True, unique=True),
+        ),
+    ]
@@ -1,13 +1,25 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 # Create your models here.
 
+def normalize_sku(sku):
+    """
+    SKUs are unique and looked up by the warehouse (/products/sku/<sku>/), so they're stored
+    one way only: without spaces around them and in lower case (the templates show them in upper case).
+    No SKU is None rather than '', the unique index allows any number of NULLs.
+    """
+    sku = (sku or '').strip().lower()
+    return sku or None
+
+
 class Category(models.Model):
 
     class Meta:
         verbose_name_plural = 'Categories'  # To fix name in admin
     
-    name = models.CharField(max_length=254)
+    name = models.CharField(max_length=254, db_index=True)  # the products page filters and sorts on it
     friendly_name = models.CharField(max_length=254, null=True, blank=True)
 
     def __str__(self):
@@ -17,8 +29,23 @@ class Category(models.Model):
         return self.friendly_name
 
 class Product(models.Model):
+
+    class Meta:
+        """
+        Indexes for the ways the products page filters and sorts (see products/pagination.py),
+        the id is in every index because it's the tie breaker for the pages.
+        """
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+            models.Index(Lower('name'), 'id', name='product_lower_name_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+            models.Index(fields=['category', 'rating', 'id'], name='product_cat_rating_idx'),
+            models.Index('category', Lower('name'), 'id', name='product_cat_lower_name_idx'),
+        ]
+
     category = models.ForeignKey('Category', null=True, blank=True, on_delete=models.SET_NULL)  # if category would be deleted, any products that use it are set to null instead of deleted
-    sku = models.CharField(max_length=254, null=True, blank=True)
+    sku = models.CharField(max_length=254, unique=True, null=True, blank=True)  # stored by normalize_sku, see below
     name = models.CharField(max_length=254)
     description = models.TextField()
     has_sizes = models.BooleanField(default=False, null=True, blank=True)
@@ -26,7 +53,47 @@ class Product(models.Model):
     rating = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     image_url = models.URLField(max_length=1024, null=True, blank=True)
     image = models.ImageField(null=True, blank=True)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)  # smaller copies of image, see products/images.py
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)  # part of the cache key of the product card
+
+    def clean(self):
+        """Runs before the unique check of the forms (and the admin), so ' PP123 ' is found to be a duplicate of pp123"""
+        self.sku = normalize_sku(self.sku)
+
+    def save(self, *args, **kwargs):
+        """Override default save method to set updated_at.
+        This does what auto_now would do, but with a default the fixtures without updated_at still load.
+        """
+        self.updated_at = timezone.now()
+        self.sku = normalize_sku(self.sku)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
+    def _derivatives(self):
+        """The smaller copies of the image, none if they were made for an image that's been replaced since"""
+        if not self.image or self.image_derivatives.get('source') != self.image.name:
+            return []
+        return self.image_derivatives.get('images', [])
+
+    def _srcset(self, extension):
+        storage = self.image.storage
+        return ', '.join(f'{storage.url(image[extension])} {image["width"]}w' for image in self._derivatives())
+
+    @property
+    def webp_srcset(self):
+        """For the srcset attribute in the templates, empty if there are no copies"""
+        return self._srcset('webp')
+
+    @property
+    def jpg_srcset(self):
+        return self._srcset('jpg')
+
+    @property
+    def thumbnail_url(self):
+        """The smallest copy of the image (for the bag and checkout), or the image itself"""
+        derivatives = self._derivatives()
+        if derivatives:
+            return self.image.storage.url(derivatives[0]['jpg'])
+        return self.image.url
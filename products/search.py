@@ -0,0 +1,105 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+
+from .models import Product
+
+"""
+Full text search for the products page.
+
+On Postgres (when DATABASE_URL is set on Heroku) we search a GIN index built on
+to_tsvector(name || description), see migration 0003.
+Locally on SQLite we keep an FTS5 virtual table with a copy of the name and
+description of every product. Postgres keeps its index up to date by itself,
+the SQLite table is updated from the signals in signals.py.
+
+Both backends annotate the queryset with search_rank, higher is more relevant.
+"""
+
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'products_product_fts'
+
+
+def search_vector():
+    """The exact same expression is used for the index in migration 0003,
+    otherwise Postgres won't use the index"""
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector('name', 'description', config=SEARCH_CONFIG)
+
+
+def _fts5_query(query):
+    """
+    Turn what the user typed into a safe FTS5 query.
+    Every word is quoted so characters like - or " can't break the MATCH syntax,
+    and gets a * so 'jean' still finds 'jeans' like icontains used to.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_products(products, query):
+    """Filter the products queryset on the search term and annotate search_rank"""
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        vector = search_vector()
+        return products.annotate(
+            search=vector,
+            search_rank=SearchRank(vector, search_query),
+        ).filter(search=search_query)
+
+    if connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            # nothing to search for, but the view still orders on search_rank
+            return products.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+        # Joining the FTS table lets SQLite run the MATCH once for the whole query.
+        # bm25 gives lower scores to better matches so we flip the sign,
+        # and a match in the name counts ten times more than in the description.
+        table = Product._meta.db_table
+        return products.extra(
+            select={'search_rank': f'-bm25({FTS_TABLE}, 10.0, 1.0)'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = {table}.id'],
+            params=[match],
+        )
+
+    # any other database, fall back to the old (slow) search
+    queries = Q(name__icontains=query) | Q(description__icontains=query)
+    return products.filter(queries).annotate(
+        search_rank=Value(0.0, output_field=FloatField()))
+
+
+def index_product(product):
+    """Add or replace a product in the SQLite search table"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [product.pk, product.name, product.description])
+
+
+def unindex_product(product_id):
+    """Remove a deleted product from the SQLite search table"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index():
+    """
+    Fill the SQLite search table again from the products table.
+    Needed after anything that skips the signals, like bulk_create or update().
+    """
+    if connection.vendor != 'sqlite':
+        return
+    table = Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+            f'SELECT id, name, description FROM {table}')
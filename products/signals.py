@@ -0,0 +1,63 @@
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
+
+from django.dispatch import receiver
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+
+from .models import Product, Category
+from .search import index_product, unindex_product
+from .cache import bump_catalogue_version
+
+"""Same idea as the signals in the checkout app,
+every time a product is saved or deleted (add_product, edit_product, delete_product, the admin)
+the search index is updated and the cached catalogue and product cards are invalidated.
+On Postgres the search index functions do nothing, the index updates itself."""
+
+
+@receiver(post_init, sender=Product)
+def remember_updated_at(sender, instance, **kwargs):
+    """Saving changes updated_at, so we keep the old value to find the old cached card.
+    Read from __dict__ so a product loaded with only() doesn't make a query for it."""
+    instance._card_updated_at = instance.__dict__.get('updated_at')
+
+
+@receiver(post_save, sender=Product)
+def update_catalogue_on_save(sender, instance, created, **kwargs):
+    """Add the new name and description to the search index and invalidate the cache"""
+    index_product(instance)
+    bump_catalogue_version()
+    delete_product_cards([(instance.pk, instance._card_updated_at)])
+    instance._card_updated_at = instance.updated_at
+
+
+@receiver(post_delete, sender=Product)
+def update_catalogue_on_delete(sender, instance, **kwargs):
+    """Remove the deleted product from the search index and invalidate the cache"""
+    unindex_product(instance.pk)
+    bump_catalogue_version()
+    delete_product_cards([(instance.pk, instance.updated_at)])
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def update_on_category_change(sender, instance, **kwargs):
+    """
+    Category filters and names are part of the cached catalogue too.
+    The product cards show the category name but don't change when it does, so we delete them
+    (without a shared cache only here, see PRODUCT_CARD_CACHE_TIMEOUT in settings.py).
+    This is pre_delete because after the delete the products don't have the category anymore.
+    """
+    bump_catalogue_version()
+    delete_product_cards(instance.product_set.values_list('id', 'updated_at'))
+
+
+def delete_product_cards(products):
+    """
+    Delete the cached product cards (products/products.html) of (id, updated_at) pairs,
+    both the card superusers see and the one everybody else sees
+    """
+    cache.delete_many([
+        make_template_fragment_key('product_card', [product_id, updated_at, is_superuser])
+        for product_id, updated_at in products
+        for is_superuser in (True, False)
+    ])
@@ -1,3 +1,161 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models.functions import Lower
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .cache import get_product
+from .models import Category, Product
+from .pagination import encode_cursor, paginate_products
+
+
+class AllProductsTests(TestCase):
+
+    def test_search_without_words(self):
+        Product.objects.create(sku='search-test-1', name='Striped Cotton Shirt', description='', price='20.00')
+
+        response = self.client.get(reverse('products'), {'q': '"-*^'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['product_total'], 0)
+
+
+class PaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=name, friendly_name=name.title()) for name in ('shirts', 'jeans')]
+        for i in range(40):
+            Product.objects.create(
+                sku=f'page-test-{i}', name=f'Product {i % 7}', description='', price=Decimal(10 + i % 5),
+                rating=None if i % 4 == 0 else Decimal(i % 3), category=None if i % 6 == 0 else categories[i % 2])
+
+    def _expected(self, sort_field, descending):
+        """All the ids in the page order, worked out in Python: sort value then id, the null sort values last"""
+        def sort_value(product):
+            if sort_field == 'category__name':
+                return product.category.name if product.category else None
+            return getattr(product, sort_field) if sort_field else product.id
+
+        products = Product.objects.annotate(lower_name=Lower('name')).select_related('category')
+        values = sorted((sort_value(product), product.id) for product in products if sort_value(product) is not None)
+        nulls = sorted(product.id for product in products if sort_value(product) is None)
+        if descending:
+            values.reverse()
+            nulls.reverse()
+        return [product_id for _, product_id in values] + nulls
+
+    def test_every_product_once_forwards_and_backwards(self):
+        for sort_field in (None, 'price', 'rating', 'lower_name', 'category__name'):
+            for descending in (False, True):
+                with self.subTest(sort_field=sort_field, descending=descending):
+                    products = Product.objects.annotate(lower_name=Lower('name'))
+                    pages = [paginate_products(products, sort_field, descending, per_page=7)]
+                    while pages[-1].has_next:
+                        pages.append(paginate_products(products, sort_field, descending,
+                                                       pages[-1].next_cursor, per_page=7))
+                    forwards = [product.id for page in pages for product in page]
+                    self.assertEqual(forwards, self._expected(sort_field, descending))
+
+                    backwards = [pages[-1]]
+                    while backwards[-1].has_previous:
+                        backwards.append(paginate_products(products, sort_field, descending,
+                                                           backwards[-1].previous_cursor, per_page=7))
+                    self.assertEqual([product.id for page in reversed(backwards) for product in page], forwards)
+
+    def test_broken_cursor_is_the_first_page(self):
+        first_page = [product.id for product in paginate_products(Product.objects.all(), 'price', per_page=7)]
+        cursors = [
+            {'s': 'price_asc', 'd': 'n', 'i': 'abc', 'v': '10.00'},
+            {'s': 'price_asc', 'd': 'n', 'i': None, 'v': '10.00'},
+            {'s': 'price_asc', 'd': 'n', 'i': 5, 'v': 'abc'},
+            {'s': 'price_asc', 'd': 'n', 'i': 5, 'v': None},
+            {'s': 'lower_name_asc', 'd': 'n', 'i': 5, 'v': 'product 1'},  # from another sorting
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                page = paginate_products(Product.objects.all(), 'price', False, encode_cursor(cursor), per_page=7)
+                self.assertEqual([product.id for product in page], first_page)
+
+
+@override_settings(PRODUCTS_PER_PAGE=500)
+class ProductListingQueriesTests(TestCase):
+
+    def test_500_products_in_a_constant_number_of_queries(self):
+        categories = [Category.objects.create(name=f'category_{i}', friendly_name=f'Category {i}') for i in range(5)]
+        Product.objects.bulk_create(
+            Product(sku=f'listing-test-{i}', name=f'Product {i}', description='', price='9.99',
+                    category=categories[i % 5])
+            for i in range(500))
+        cache.clear()  # nothing from the product cards or counts cached, every card renders its category
+
+        # the product count, and the products with their categories: the ones with a category,
+        # then the ones without (see products/pagination.py)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('products'), {'sort': 'category', 'direction': 'asc'})
+        self.assertEqual(len(response.context['products']), 500)
+
+
+class CatalogueCacheTests(TestCase):
+
+    def setUp(self):
+        self.product = Product.objects.create(sku='cache-test-1', name='Wool Coat', description='', price='80.00')
+        cache.clear()
+
+    def _name_changed_by_another_process(self):
+        """update() sends no signals, like a save in another process doesn't reach this process's cache"""
+        Product.objects.filter(pk=self.product.pk).update(name='Wool Winter Coat')
+
+    @override_settings(CACHE_SHARED=True)  # the test's locmem cache, as if it were redis
+    def test_shared_cache_keeps_the_product(self):
+        self.assertEqual(get_product(self.product.pk).name, 'Wool Coat')
+        self._name_changed_by_another_process()
+        self.assertEqual(get_product(self.product.pk).name, 'Wool Coat')
+
+    @override_settings(CACHE_SHARED=False)
+    def test_cache_per_process_reads_the_database(self):
+        self.assertEqual(get_product(self.product.pk).name, 'Wool Coat')
+        self._name_changed_by_another_process()
+        self.assertEqual(get_product(self.product.pk).name, 'Wool Winter Coat')
+
+
+class ImportCatalogueTests(TestCase):
+
+    def _import(self, rows):
+        """Import rows from a JSON file, returns what the command wrote to stderr"""
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump(rows, file)
+        self.addCleanup(os.remove, file.name)
+        errors = io.StringIO()
+        call_command('import_catalogue', file.name, stdout=io.StringIO(), stderr=errors)
+        return errors.getvalue()
+
+    def test_values_that_dont_fit_the_columns_skip_the_row(self):
+        errors = self._import([
+            {'sku': 'big-price', 'name': 'A', 'price': '123456.789'},
+            {'sku': 'huge-rating', 'name': 'B', 'price': '1.00', 'rating': '1e400'},
+            {'sku': 'fine', 'name': 'C', 'price': '9.99', 'rating': '4.5'},
+        ])
+        self.assertIn('product 1', errors)
+        self.assertIn('product 2', errors)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['fine'])
+
+    def test_rows_with_the_same_sku_are_merged(self):
+        errors = self._import([
+            {'sku': 'x3', 'name': 'A', 'price': '9.99', 'category': 'new_cat'},
+            {'sku': 'x3', 'name': 'B'},
+        ])
+        self.assertEqual(errors, '')
+        product = Product.objects.get(sku='x3')
+        self.assertEqual((product.name, product.price, product.category.name), ('B', Decimal('9.99'), 'new_cat'))
+
+    def test_no_category_for_a_skipped_product(self):
+        errors = self._import([{'sku': 'x4', 'name': 'A', 'category': 'nope_cat'}])
+        self.assertIn('x4: a new product needs a name and a price', errors)
+        self.assertFalse(Category.objects.filter(name='nope_cat').exists())
@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+catalogue = async_views if settings.ASYNC_VIEWS else views  # see async_views.py
 
 urlpatterns = [
-    path('', views.all_products, name='products'),
-    path('<int:product_id>/', views.product_detail, name='product_detail'),
+    path('', catalogue.all_products, name='products'),
+    path('<int:product_id>/', catalogue.product_detail, name='product_detail'),
+    path('sku/<str:sku>/', views.product_by_sku, name='product_by_sku'),
     path('add/', views.add_product, name='add_product'),
     path('edit/<int:product_id>/', views.edit_product, name='edit_product'),
     path('delete/<int:product_id>/', views.delete_product, name='delete_product'),
@@ -1,9 +1,14 @@
 from django.shortcuts import render, get_object_or_404, redirect, reverse
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_GET
 from django.contrib import messages 
-from django.db.models import Q
+from django.conf import settings
 from django.db.models.functions import Lower
-from .models import Product, Category
+from .models import Product, normalize_sku
 from .forms import ProductForm
+from .search import search_products
+from .pagination import paginate_products, paginate_search_results
+from .cache import cached_product_count, get_product, get_product_by_sku, get_categories
 from django.contrib.auth.decorators import login_required
 
 # Create your views here.
@@ -12,12 +17,13 @@ def all_products(request):
     """A view to show all products,
     including sorting and search queries
     """
-    products = Product.objects.all()
+    products = Product.objects.select_related('category')  # every product card shows the category, get it in the same query
     #  below variables are equal to none at the top. Since we'll need to make sure those are defined in order to return the template properly when we're not using any sorting etc.
     query = None
     categories = None
     sort = None
     direction = None
+    sortkey = None  # the field the page is sorted and paginated on, None is the default order (id)
     
 
     if request.GET:
@@ -29,42 +35,67 @@ def all_products(request):
                     products = products.annotate(lower_name=Lower('name'))
                 if sortkey == 'category':
                     sortkey = 'category__name'  # sort on category name instead of id (I did not see the difference though)
+                if sortkey not in ('price', 'rating', 'lower_name', 'category__name'):
+                    sortkey = None  # don't let the url sort on any field
 
                 if 'direction' in request.GET:
                     direction = request.GET['direction']
-                    if direction == 'desc':
-                        sortkey = f'-{sortkey}'
-                products = products.order_by(sortkey)  # actually sorting the products
 
         if 'category' in request.GET:
             categories = request.GET['category'].split(',')
             products = products.filter(category__name__in=categories)
-            categories = Category.objects.filter(name__in=categories)  # so we can access the fields in the template
+            categories = [c for c in get_categories() if c.name in categories]  # so we can access the fields in the template
 
         if 'q' in request.GET:
             query = request.GET['q']
             if not query:
                 messages.error(request, 'You did not enter any search criteria')
                 return redirect(reverse('products'))
-            
-            queries = Q(name__icontains=query) | Q(description__icontains=query)
-            products = products.filter(queries)
-    
+
+            products = search_products(products, query)
+
+    # count the products separately (and cached) instead of loading all of them to get the length
+    product_total = cached_product_count(products)
+
+    # only one page of products is loaded, the cursor in the url says where the page starts
+    cursor = request.GET.get('cursor')
+    if query and not sortkey:
+        page = paginate_search_results(
+            products.order_by('-search_rank', 'id'), cursor, settings.PRODUCTS_PER_PAGE)  # best matches first unless the user picked a sorting
+    else:
+        page = paginate_products(
+            products, sortkey, direction == 'desc', cursor, settings.PRODUCTS_PER_PAGE)
+
     current_sorting = f'{sort}_{direction}'
 
     context = {
-        'products': products,
+        'products': page,
+        'product_total': product_total,
+        'next_page_url': _page_url(request, page.next_cursor),
+        'previous_page_url': _page_url(request, page.previous_cursor),
         'search_term': query,
         'current_categories': categories,
         'current_sorting': current_sorting,
+        'product_card_cache_timeout': settings.PRODUCT_CARD_CACHE_TIMEOUT,
     } 
 
     return render(request, 'products/products.html', context)
 
+
+def _page_url(request, cursor):
+    """The current url with the filters and sorting kept, but starting at another page"""
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'?{params.urlencode()}'
+
 def product_detail(request, product_id):
     """A view to show the product details
     """
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_product(product_id)  # from the cache, with its category
+    if product is None:
+        raise Http404('No product found')
 
     context = {
         'product': product,
@@ -72,6 +103,28 @@ def product_detail(request, product_id):
 
     return render(request, 'products/product_detail.html', context)
 
+@require_GET
+def product_by_sku(request, sku):
+    """
+    For the warehouse tooling: a product found by its SKU, as JSON.
+    Answered from the cache (see cache.get_product_by_sku), so most lookups don't touch the database.
+    """
+    sku = normalize_sku(sku)
+    product = None
+    if sku and len(sku) <= 254 and not any(c.isspace() for c in sku):  # anything else can't be a SKU
+        product = get_product_by_sku(sku)
+    if product is None:
+        return JsonResponse({'error': 'No product with this SKU'}, status=404)
+
+    return JsonResponse({
+        'id': product['id'],
+        'sku': product['sku'],
+        'name': product['name'],
+        'price': product['price'],
+        'category': product['category__name'],
+        'url': reverse('product_detail', args=[product['id']]),
+    })
+
 @login_required
 def add_product(request):
     """Add a product to the store"""
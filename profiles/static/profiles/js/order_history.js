@@ -0,0 +1,33 @@
+/*
+    Infinite scroll for the order history on the profile page.
+    The page only shows the newest orders, when the "Loading older orders" line
+    scrolls into view we get the next page from the order_history_page view
+    and add its rows to the table, until there are no older orders.
+*/
+let moreOrders = document.getElementById('order-history-more');
+if (moreOrders) {
+    let loading = false;
+    let observer = new IntersectionObserver(function(entries) {
+        if (!entries[0].isIntersecting || loading) {
+            return;
+        }
+        loading = true;
+        $.getJSON($(moreOrders).data('url'), function(data) {
+            $('.order-history tbody').append(data.html);
+            if (data.next_url) {
+                $(moreOrders).data('url', data.next_url);
+                loading = false;
+                // still in view (a tall screen), load the next page straight away
+                observer.unobserve(moreOrders);
+                observer.observe(moreOrders);
+            } else {
+                observer.disconnect();
+                $(moreOrders).remove();
+            }
+        }).fail(function() {
+            $(moreOrders).text('Could not load older orders, please reload the page.');
+            observer.disconnect();
+        });
+    }, {root: document.querySelector('.order-history')});
+    observer.observe(moreOrders);
+}
@@ -1,3 +1,34 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from checkout.models import Order
+from products.pagination import encode_cursor
+
+
+class OrderHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('history-test', 'history@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def _order(self, **fields):
+        return Order.objects.create(
+            user_profile=self.user.userprofile, full_name='Test Customer', email='history@example.com',
+            phone_number='0123', country='GB', town_or_city='Leeds', street_address1='1 High Street', **fields)
+
+    def test_orders_placed_together_are_told_apart(self):
+        orders = [self._order(), self._order()]
+
+        content = self.client.get(reverse('profile')).content.decode()
+
+        for order in orders:
+            self.assertIn(f'&hellip;{order.order_number[-6:]}', content)
+
+    def test_broken_cursor_is_the_first_page(self):
+        order = self._order()
+        for cursor in ({'date': '2020-13-01T00:00:00', 'id': 5}, {'date': '2020-01-01T00:00:00', 'id': 'abc'}):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('order_history_page'), {'cursor': encode_cursor(cursor)})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(order.order_number, response.content.decode())
@@ -3,5 +3,6 @@ from . import views
 
 urlpatterns = [
     path('', views.profile, name='profile'),
+    path('orders/', views.order_history_page, name='order_history_page'),
     path('order_history/<order_number>', views.order_history, name='order_history'),
 ]
@@ -1,12 +1,57 @@
 from django.shortcuts import render, get_object_or_404
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from .models import UserProfile
 from .forms import UserProfileForm
-from checkout.models import Order
+from checkout.models import Order, OrderLineItem
+from products.pagination import encode_cursor, decode_cursor
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
 # Create your views here.
 
+def _order_history_page(profile, cursor=None):
+    """
+    One page of the profile's orders, newest first, and the cursor for the next (older) page.
+
+    Like the products page it's keyset pagination: the next page starts after the date and id of
+    the last order, which the order_history_idx index on (user_profile, date, id) finds straight away.
+    Only the columns the order history table shows are loaded, the line items and their
+    products come in one query for the whole page.
+    """
+    per_page = settings.ORDER_HISTORY_PER_PAGE
+    line_items = OrderLineItem.objects.select_related('product').only(
+        'order', 'quantity', 'product_size', 'product__name', 'product__has_sizes')
+    orders = profile.orders.only('user_profile', 'order_number', 'date', 'grand_total').order_by('-date', '-id') \
+        .prefetch_related(Prefetch('lineitems', queryset=line_items))
+
+    position = decode_cursor(cursor)
+    try:
+        date = parse_datetime(position['date']) if isinstance(position.get('date'), str) else None
+    except ValueError:  # well formed but not a date, like month 13: the first page
+        date = None
+    last_id = position.get('id')
+    if date is not None and type(last_id) is int and 0 < last_id < 2 ** 63:
+        # date <= on its own first, so the index scan starts at the cursor (see products/pagination.py)
+        orders = orders.filter(Q(date__lte=date) & (Q(date__lt=date) | Q(date=date, id__lt=last_id)))
+
+    orders = list(orders[:per_page + 1])
+    next_cursor = None
+    if len(orders) > per_page:
+        orders = orders[:per_page]
+        # isoformat ourselves, the json encoder would cut the microseconds off
+        next_cursor = encode_cursor({'date': orders[-1].date.isoformat(), 'id': orders[-1].id})
+    return orders, next_cursor
+
+
+def _next_page_url(next_cursor):
+    return f'{reverse("order_history_page")}?cursor={next_cursor}' if next_cursor else None
+
+
 @login_required
 def profile(request):
     """display the user's profile"""
@@ -23,18 +68,30 @@ def profile(request):
     else:
         form = UserProfileForm(instance=profile)
 
-    orders = profile.orders.all()
+    orders, next_cursor = _order_history_page(profile)
 
     template = 'profiles/profile.html'
     context = {
         'form': form,
         'orders': orders,
+        'next_orders_url': _next_page_url(next_cursor),  # the javascript loads the older orders from here
         'on_profile_page': True,
     }
 
     return render(request, template, context)
 
 
+@login_required
+def order_history_page(request):
+    """The next page of the order history as json, the rows are rendered with the same template as the profile page"""
+    profile = get_object_or_404(UserProfile, user=request.user)
+    orders, next_cursor = _order_history_page(profile, request.GET.get('cursor'))
+    return JsonResponse({
+        'html': render_to_string('profiles/includes/order_history_rows.html', {'orders': orders}, request=request),
+        'next_url': _next_page_url(next_cursor),
+    })
+
+
 def order_history(request, order_number):
     order = get_object_or_404(Order, order_number=order_number)
 
@@ -45,6 +102,9 @@ def order_history(request, order_number):
     template = 'checkout/checkout_success.html'
     context = {
         'order': order,
+        # not evaluated when the order details are in the cache, otherwise one query for all the line items
+        'line_items': order.lineitems.select_related('product'),
+        'confirmation_cache_timeout': settings.ORDER_CONFIRMATION_CACHE_TIMEOUT,
         'from_profile': True,  # Instead, I've added another variable to the context called from_profile So we can check in that template if the user got there via the order history view. This is done in checkout_succes.html
     }
 